@@ -0,0 +1,35 @@
+"""Prefix sums of a player's fixtures, which are materialized at ingest so
+that the total of any run of consecutive fixtures (e.g. the last 5, or the
+last 5 against a team) takes one subtraction per column.
+"""
+
+
+def create_group(ids, rows, columns):
+    """Returns the IDs of the given rows and the prefix sums of each column,
+    i.e. `sums[column][i]` is the sum of the column over the first i rows.
+    """
+    sums = {}
+    for column in columns:
+        total = 0
+        prefix_sums = [0]
+        for row in rows:
+            total += row[column]
+            prefix_sums.append(total)
+        sums[column] = prefix_sums
+
+    return {"ids": list(ids), "sums": sums}
+
+
+def covers(group, ids):
+    """Returns True if the group's first rows are the rows with the given
+    IDs, in the same order, so its sums can be used for them.
+    """
+    return group["ids"][:len(ids)] == list(ids)
+
+
+def window_totals(group, start, end):
+    """Returns the total of each column over the rows from `start` up to (but
+    not including) `end`.
+    """
+    return {column: prefix_sums[end] - prefix_sums[start]
+            for column, prefix_sums in group["sums"].items()}
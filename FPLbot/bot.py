@@ -2,31 +2,46 @@ import asyncio
 import json
 import logging
 import os
+import queue
 import re
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 import aiohttp
 import praw
+import praw.exceptions
 import prawcore
 from fpl import FPL
+from fpl.constants import API_URLS
+from fpl.models.player import Player
 from fpl.utils import position_converter
-from pymongo import MongoClient
+from pymongo import UpdateOne
 
 from constants import fpl_team_names, versus_pattern
-from utils import (create_logger, find_player, get_player_table,
-                   get_relevant_fixtures, player_vs_player_table,
-                   player_vs_team_table, to_fpl_team, update_players)
+from http_cache import create_session
+from metrics import metrics, start_metrics_dump, start_metrics_server
+from repository import get_database, get_player_costs, get_table_player
+from utils import (ReplyCache, create_logger, create_understat_columns,
+                   find_player_id, get_opponent_totals, get_player_table,
+                   get_relevant_matches, get_reply_cache_key,
+                   get_results_index, player_vs_player_table,
+                   player_vs_team_table, run_blocking, to_fpl_team,
+                   update_players, update_results)
 
 dirname = os.path.dirname(os.path.realpath(__file__))
 logger = create_logger()
-client = MongoClient()
+
+# PRAW 7 renamed APIException to RedditAPIException
+RedditAPIException = getattr(praw.exceptions, "RedditAPIException",
+                             getattr(praw.exceptions, "APIException", None))
 
 
 class FPLBot:
     def __init__(self, config, session):
         self.config = config
-        self.database = client.fpl
+        self.database = get_database("fpl")
         self.fpl = FPL(session)
         self.reddit = praw.Reddit(
             client_id=config.get("CLIENT_ID"),
@@ -34,34 +49,104 @@ class FPLBot:
             password=config.get("PASSWORD"),
             user_agent=config.get("USER_AGENT"),
             username=config.get("USERNAME"))
+        self.session = session
         self.subreddit = self.reddit.subreddit(self.config.get("SUBREDDIT"))
+        # pymongo is blocking, so it is used from these threads to keep the
+        # event loop free. The outbox and the price change ledger have their
+        # own threads, so replies and posts aren't held up by the comment
+        # handlers. PRAW is blocking and not thread-safe, so all of its
+        # requests are made from a single thread.
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.get("WORKERS", 4))
+        self.database_executor = ThreadPoolExecutor(max_workers=2)
+        self.reddit_executor = ThreadPoolExecutor(max_workers=1)
+        # Matched comments waiting to be handled, bounded so that the stream
+        # pauses when the workers can't keep up.
+        self.comment_queue = None
+        self.pending_comments = set()
+        # Set when a reply is added to the outbox, to wake up the sender
+        self.outbox_event = None
+        self.loop = None
+        # Time (in seconds since the epoch) until which Reddit doesn't allow
+        # the bot to reply.
+        self.paused_until = 0
+        self.warned_rate_limit = False
+        # IDs of comments that have been replied to, loaded when the bot
+        # starts and written to the database in batches.
+        self.seen_comments = None
+        self.comment_writes = queue.Queue()
+        self.comment_writer = None
+        self.reply_cache = ReplyCache(
+            maxsize=self.config.get("REPLY_CACHE_SIZE", 256),
+            ttl=self.config.get("REPLY_CACHE_TTL", 3600))
+
+    def load_price_snapshot(self):
+        """Returns the cost of each player when the price changes were last
+        posted. The first time, the stored players' costs are used.
+        """
+        return get_player_costs("price_snapshot") or get_player_costs()
+
+    def save_price_snapshot(self, players):
+        """Stores the cost of the given players, which the next price changes
+        are compared to.
+        """
+        self.database.price_snapshot.bulk_write([
+            UpdateOne({"id": player.id},
+                      {"$set": {"now_cost": player.now_cost}}, upsert=True)
+            for player in players
+        ])
 
     async def get_price_changers(self, new_players):
-        """Returns a list of players whose price has changed since the last
-        time the database was updated.
+        """Returns a list of players whose price has changed since the price
+        changes were last posted.
         """
         logger.info("Retrieving risers and fallers.")
+        old_costs = await self.run_database(self.load_price_snapshot)
 
         risers = []
         fallers = []
 
         for new_player in new_players:
-            old_player = self.database.players.find_one({"id": new_player.id})
+            old_cost = old_costs.get(new_player.id)
             # New player has been added to the game
-            if not old_player:
+            if old_cost is None:
                 logger.info(f"New player added: {new_player}.")
                 continue
 
-            if old_player["now_cost"] > new_player.now_cost:
+            if old_cost > new_player.now_cost:
                 fallers.append(new_player)
-            elif old_player["now_cost"] < new_player.now_cost:
+            elif old_cost < new_player.now_cost:
                 risers.append(new_player)
 
         return risers, fallers
 
+    async def get_price_changer_summaries(self, risers, fallers):
+        """Adds the history of each riser and faller, which is only fetched
+        for the players whose price has actually changed.
+        """
+        async def add_history(player):
+            url = API_URLS["player"].format(player.id)
+            async with self.session.get(url) as response:
+                summary = await response.json()
+            player.history = summary["history"]
+
+        logger.info(f"Retrieving summaries of {len(risers + fallers)} "
+                    "players.")
+        await asyncio.gather(*[add_history(player)
+                               for player in risers + fallers])
+        return risers, fallers
+
     async def post_price_changes(self, players):
-        """Posts the price changes to Reddit."""
+        """Posts the price changes to Reddit, if there are any. Returns
+        whether a post was made.
+        """
         risers, fallers = await self.get_price_changers(players)
+        if not risers and not fallers:
+            logger.info("No price changes found.")
+            return False
+
+        risers, fallers = await self.get_price_changer_summaries(
+            risers, fallers)
         risers_table = get_player_table(risers, True)
         fallers_table = get_player_table(fallers, False)
 
@@ -79,21 +164,59 @@ class FPLBot:
         post_title = f"Player Price Changes {current_date}"
 
         logger.info(f"Posting price changes to Reddit.\n\n{post_body}")
-        self.subreddit.submit(post_title, selftext=post_body)
-        await update_players()
+        await self.run_reddit(
+            self.subreddit.submit, post_title, selftext=post_body)
+        await self.run_database(self.record_price_change_post, post_title)
+        await self.run_database(self.save_price_snapshot, players)
+        return True
+
+    def record_price_change_post(self, post_title):
+        """Adds today's price change post to the ledger of posted days."""
+        self.database.price_posts.update_one(
+            {"date": f"{datetime.now():%Y-%m-%d}"},
+            {"$setOnInsert": {"title": post_title,
+                              "posted_at": datetime.utcnow()}},
+            upsert=True)
+
+    async def run_blocking(self, function, *args, **kwargs):
+        """Runs the blocking function in the bot's thread pool."""
+        return await run_blocking(
+            function, *args, executor=self.executor, **kwargs)
+
+    async def run_database(self, function, *args, **kwargs):
+        """Runs the function using the outbox or the price change ledger in
+        their own threads.
+        """
+        return await run_blocking(
+            function, *args, executor=self.database_executor, **kwargs)
+
+    async def run_reddit(self, function, *args, **kwargs):
+        """Runs the function using PRAW in the thread used for Reddit."""
+        return await run_blocking(
+            function, *args, executor=self.reddit_executor, **kwargs)
 
     def versus_player_handler(self, player_A_name, player_B_name,
                               number_of_fixtures):
         """Function for handling player vs. player comment."""
-        player_A = find_player(player_A_name)
-        player_B = find_player(player_B_name)
+        player_A_id = find_player_id(player_A_name)
+        player_B_id = find_player_id(player_B_name)
 
-        if not player_A or not player_B:
+        if player_A_id is None or player_B_id is None:
             return
 
         if not number_of_fixtures or number_of_fixtures > 10:
             number_of_fixtures = 10
 
+        cache_key = get_reply_cache_key(
+            "player", player_A_id, player_B_id, number_of_fixtures)
+        reply_text = self.reply_cache.get(cache_key)
+        if reply_text:
+            metrics.increment("reply_cache_hits")
+            return reply_text
+
+        player_A = get_table_player(player_A_id)
+        player_B = get_table_player(player_B_id)
+
         post_template = open(f"{dirname}/../comment_template.md").read()
         table_header = (
             f"# {player_A['web_name']} (£{player_A['now_cost'] / 10.0:.1f}) "
@@ -101,49 +224,266 @@ class FPLBot:
             f"(last {number_of_fixtures} fixtures)\n\n---")
 
         players = [player_A, player_B]
-        table_body = player_vs_player_table(players, number_of_fixtures)
+        with metrics.span("render"):
+            table_body = player_vs_player_table(players, number_of_fixtures)
 
-        return post_template.format(
+        reply_text = post_template.format(
             comment_header=table_header,
             comment_body=table_body
         )
+        self.reply_cache.set(cache_key, reply_text)
+        return reply_text
 
     def versus_team_handler(self, player_name, team_name, number_of_fixtures):
         """Function for handling player vs. team comment."""
-        player = find_player(player_name)
-        if not player:
+        player_id = find_player_id(player_name)
+        if player_id is None:
             return
 
         if not number_of_fixtures or number_of_fixtures > 10:
             number_of_fixtures = 10
 
-        fixtures = get_relevant_fixtures(
-            player, team_name=to_fpl_team(team_name))[:number_of_fixtures]
+        # The header uses the names as written in the comment, so only the
+        # table itself is cached.
+        cache_key = get_reply_cache_key(
+            "team", player_id, to_fpl_team(team_name), number_of_fixtures)
+        cached_table = self.reply_cache.get(cache_key)
+        if cached_table:
+            metrics.increment("reply_cache_hits")
+            number_of_rows, table_body = cached_table
+        else:
+            player = get_table_player(player_id)
+            matches = get_relevant_matches(
+                player, team_name=to_fpl_team(team_name),
+                limit=number_of_fixtures)
+            number_of_rows = len(matches)
+            totals = get_opponent_totals(
+                player_id, to_fpl_team(team_name), matches)
+            with metrics.span("render"):
+                table_body = player_vs_team_table(
+                    create_understat_columns(matches), range(number_of_rows),
+                    totals)
+            self.reply_cache.set(cache_key, (number_of_rows, table_body))
+
         post_template = open(f"{dirname}/../comment_template.md").read()
         table_header = (
             f"# {player_name.title()} vs. {team_name.title()} (last "
-            f"{len(fixtures)} fixtures)")
-        table_body = player_vs_team_table(fixtures)
+            f"{number_of_rows} fixtures)")
 
         return post_template.format(
             comment_header=table_header,
             comment_body=table_body
         )
 
-    def add_comment_to_database(self, comment):
-        self.database.comments.update_one(
+    def load_seen_comments(self):
+        """Loads the IDs of all comments that have been replied to (once)."""
+        if self.seen_comments is not None:
+            return
+
+        self.database.comments.create_index("comment_id", unique=True)
+        self.database.outbox.create_index("comment_id", unique=True)
+        self.database.outbox.create_index([("status", 1),
+                                           ("next_attempt_at", 1)])
+        # Comments with a reply in the outbox have been handled as well
+        self.seen_comments = {
+            comment["comment_id"]
+            for collection in (self.database.comments, self.database.outbox)
+            for comment in collection.find({}, {"_id": 0, "comment_id": 1})
+        }
+        logger.info(f"Loaded {len(self.seen_comments)} seen comments.")
+
+    def add_comment_to_database(self, comment_id):
+        self.seen_comments.add(comment_id)
+        self.comment_writes.put(comment_id)
+
+    def add_reply_to_outbox(self, comment, reply_text):
+        """Stores the reply in the outbox, from which it is sent when Reddit's
+        rate limit allows it.
+        """
+        self.seen_comments.add(comment.id)
+        now = datetime.utcnow()
+        self.database.outbox.update_one(
             {"comment_id": comment.id},
-            {"$set": {"comment_id": comment.id}},
+            {"$setOnInsert": {
+                "comment_id": comment.id,
+                "reply_text": reply_text,
+                "status": "pending",
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now
+            }},
             upsert=True
         )
 
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.outbox_event.set)
+
+    def get_reply_delay(self):
+        """Returns the number of seconds to wait before sending the next
+        reply, spreading the requests Reddit still allows evenly until its
+        rate limit resets.
+        """
+        minimum_delay = self.config.get("REPLY_INTERVAL", 1)
+        if time.time() < self.paused_until:
+            return self.paused_until - time.time()
+
+        # PRAW keeps track of Reddit's X-Ratelimit-* headers. Older versions
+        # of prawcore keep the time the rate limit resets, newer versions
+        # (2.4+) only the time they allow the next request.
+        limits = getattr(self.reddit.auth, "limits", None) or {}
+        rate_limiter = getattr(self.reddit._core, "_rate_limiter", None)
+        remaining = limits.get("remaining",
+                               getattr(rate_limiter, "remaining", None))
+        reset_timestamp = limits.get(
+            "reset_timestamp", getattr(rate_limiter, "reset_timestamp", None))
+        next_request = getattr(rate_limiter, "next_request_timestamp_ns", None)
+
+        if remaining is None:
+            # No requests have been made yet
+            return minimum_delay
+        if reset_timestamp is not None:
+            seconds_left = max(0, reset_timestamp - time.time())
+            return max(minimum_delay, seconds_left / max(remaining, 1))
+        if next_request is not None:
+            return max(minimum_delay,
+                       (next_request - time.monotonic_ns()) / 1e9)
+
+        if not self.warned_rate_limit:
+            logger.warning("Reddit's rate limit isn't available, so replies "
+                           f"are sent every {minimum_delay} seconds.")
+            self.warned_rate_limit = True
+        return minimum_delay
+
+    def reschedule_reply(self, reply, error):
+        """Schedules the reply to be sent again with exponential backoff, or
+        marks it as failed after too many attempts.
+        """
+        attempts = reply["attempts"] + 1
+        if attempts >= self.config.get("REPLY_MAX_ATTEMPTS", 5):
+            update = {"status": "failed", "error": str(error)}
+            metrics.increment("comments_failed")
+            logger.error(f"Could not reply to {reply['comment_id']}: {error}")
+        else:
+            delay = self.config.get("REPLY_BACKOFF", 30) * 2 ** attempts
+            update = {"next_attempt_at":
+                      datetime.utcnow() + timedelta(seconds=delay)}
+
+        self.database.outbox.update_one(
+            {"_id": reply["_id"]},
+            {"$set": {"attempts": attempts, **update}}
+        )
+
+    async def send_reply(self, reply):
+        """Sends the reply from the outbox to Reddit."""
+        def send():
+            comment = self.reddit.comment(reply["comment_id"])
+            with metrics.span("reply"):
+                comment.reply(reply["reply_text"])
+
+        try:
+            await self.run_reddit(send)
+        except RedditAPIException as error:
+            # Newer versions of PRAW group the errors in `items`
+            item = getattr(error, "items", [error])[0]
+            if item.error_type != "RATELIMIT":
+                await self.run_database(self.reschedule_reply, reply, error)
+                return
+
+            # E.g. "you are doing that too much. try again in 5 minutes."
+            match = re.search(r"(\d+) (minute|second)", item.message)
+            delay = 600
+            if match:
+                delay = int(match.group(1)) * (
+                    60 if match.group(2) == "minute" else 1)
+            logger.error(f"Rate limited by Reddit for {delay} seconds.")
+            self.paused_until = time.time() + delay
+        except (prawcore.exceptions.PrawcoreException,
+                praw.exceptions.PRAWException) as error:
+            await self.run_database(self.reschedule_reply, reply, error)
+        else:
+            await self.run_database(
+                self.database.outbox.update_one,
+                {"_id": reply["_id"]},
+                {"$set": {"status": "sent", "sent_at": datetime.utcnow()}}
+            )
+            metrics.increment("comments_replied")
+            self.add_comment_to_database(reply["comment_id"])
+
+    async def send_replies(self):
+        """Sends the replies in the outbox, paced according to Reddit's rate
+        limit.
+        """
+        batch_size = self.config.get("REPLY_BATCH_SIZE", 10)
+
+        while True:
+            replies = await self.run_database(lambda: list(
+                self.database.outbox.find({
+                    "status": "pending",
+                    "next_attempt_at": {"$lte": datetime.utcnow()}
+                }).sort("created_at", 1).limit(batch_size)))
+
+            if not replies:
+                self.outbox_event.clear()
+                try:
+                    await asyncio.wait_for(self.outbox_event.wait(),
+                                           timeout=60)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for reply in replies:
+                await asyncio.sleep(self.get_reply_delay())
+                await self.send_reply(reply)
+
+    def write_comments(self):
+        """Writes the IDs of replied to comments to the database in batches
+        until the process exits.
+        """
+        batch_size = self.config.get("COMMENT_BATCH_SIZE", 50)
+        interval = self.config.get("COMMENT_FLUSH_INTERVAL", 5)
+
+        while True:
+            comment_ids = [self.comment_writes.get()]
+            deadline = time.monotonic() + interval
+            while len(comment_ids) < batch_size:
+                try:
+                    comment_ids.append(self.comment_writes.get(
+                        timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            requests = [UpdateOne({"comment_id": comment_id},
+                                  {"$set": {"comment_id": comment_id}},
+                                  upsert=True)
+                        for comment_id in comment_ids]
+            try:
+                self.database.comments.bulk_write(requests, ordered=False)
+            except Exception as error:
+                logger.error(f"Could not write comments: {error}")
+                # They are still in memory, so try again with the next batch
+                for comment_id in comment_ids:
+                    self.comment_writes.put(comment_id)
+                time.sleep(interval)
+
+    def start_comment_writer(self):
+        """Starts the thread writing replied to comments (once)."""
+        if self.comment_writer:
+            return
+
+        self.comment_writer = threading.Thread(
+            target=self.write_comments, daemon=True)
+        self.comment_writer.start()
+
     def comment_handler(self, comment):
         """Generic comment handler."""
-        match = re.search(versus_pattern, comment.body.lower())
+        with metrics.span("parse"):
+            match = re.search(versus_pattern, comment.body.lower())
 
         if not match:
             return
 
+        metrics.increment("comments_matched")
+
         player_name = match.group(1).lower().strip()
         opponent_name = match.group(2).lower().replace(".", "").strip()
         number = match.group(3)
@@ -159,54 +499,156 @@ class FPLBot:
                 player_name, opponent_name, number)
 
         if reply_text:
-            comment.reply(reply_text)
-            self.add_comment_to_database(comment)
+            self.add_reply_to_outbox(comment, reply_text)
 
     async def has_posted_price_change(self):
-        today = datetime.now()
-        current_date = f"({today:%B} {today.day}, {today.year})"
-        post_title = f"Player Price Changes {current_date}"
-
-        for submission in self.reddit.redditor("FantasyPL_bot").submissions.new():
-            if (submission.title == post_title):
-                return True
-            return False
+        """Returns whether today's price changes have already been posted,
+        according to the ledger of posted days.
+        """
+        date = f"{datetime.now():%Y-%m-%d}"
+        post = await self.run_database(
+            self.database.price_posts.find_one, {"date": date})
+        return post is not None
 
     def is_new_comment(self, comment_id):
-        if self.database.comments.count_documents({"comment_id": comment_id}) < 1:
-            return True
-        return False
+        return comment_id not in self.seen_comments
+
+    async def comment_worker(self):
+        """Handles comments taken from the queue until the bot stops."""
+        while True:
+            comment = await self.comment_queue.get()
+            try:
+                await self.run_blocking(self.comment_handler, comment)
+            except Exception as error:
+                metrics.increment("comments_failed")
+                logger.error(f"Something went wrong: {error}")
+            finally:
+                self.pending_comments.discard(comment.id)
+                self.comment_queue.task_done()
+
+    async def enqueue_comment(self, comment):
+        """Adds the comment to the queue, unless it is already being handled.
+        Waits while the queue is full.
+        """
+        if comment.id in self.pending_comments:
+            return
+
+        self.pending_comments.add(comment.id)
+        await self.comment_queue.put(comment)
+
+    async def stream_comments(self):
+        """Puts new comments calling the bot on the queue. Reddit is checked
+        for new comments every STREAM_INTERVAL seconds.
+        """
+        # The stream yields None when there are no new comments, instead of
+        # blocking the thread used for Reddit until one arrives.
+        stream = self.subreddit.stream.comments(pause_after=0)
+
+        while True:
+            comment = await self.run_reddit(next, stream)
+            if comment is None:
+                await asyncio.sleep(self.config.get("STREAM_INTERVAL", 5))
+                continue
 
-    def run(self):
-        for comment in self.subreddit.stream.comments():
+            metrics.increment("comments_seen")
             body = comment.body.lower()
             if self.config.get("BOT_PREFIX") in body:
                 if not self.is_new_comment(comment.id):
                     continue
 
-                try:
-                    self.comment_handler(comment)
-                except Exception as error:
-                    logger.error(f"Something went wrong: {error}")
+                await self.enqueue_comment(comment)
 
+    async def refresh_data(self):
+        """Updates the players and results every REFRESH_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(self.config.get("REFRESH_INTERVAL", 3600))
+            await update_players()
+            await update_results()
+
+    async def get_bootstrap(self):
+        """Returns FPL's bootstrap and the digest of its content. The cached
+        bootstrap is revalidated with a conditional request, so it is only
+        downloaded again when it has changed.
+        """
+        async with self.session.get(API_URLS["static"]) as response:
+            response.raise_for_status()
+            return await response.json(), response.digest
 
-async def main(config):
-    async with aiohttp.ClientSession() as session:
-        fpl_bot = FPLBot(config, session)
+    async def watch_price_changes(self):
+        """Polls FPL's bootstrap every PRICE_CHANGE_INTERVAL seconds and posts
+        the price changes as soon as they happen.
+        """
+        interval = self.config.get("PRICE_CHANGE_INTERVAL", 60)
+        last_digest = None
+
+        while True:
+            try:
+                bootstrap, digest = await self.get_bootstrap()
+            except (aiohttp.ClientError, ValueError) as error:
+                # The API is unavailable while the game is being updated
+                logger.error(f"Could not retrieve bootstrap: {error}")
+                await asyncio.sleep(interval)
+                continue
+
+            if (digest != last_digest and
+                    not await self.has_posted_price_change()):
+                players = [Player(element, self.session)
+                           for element in bootstrap["elements"]]
+                if await self.post_price_changes(players):
+                    await update_players()
+            last_digest = digest
 
+            await asyncio.sleep(interval)
+
+    async def keep_running(self, task):
+        """Runs the task forever, restarting it after something went wrong."""
         while True:
             try:
-                fpl_bot.run()
-            except prawcore.exceptions.ServerError as http_error:
-                logger.error(http_error)
-                time.sleep(120)
-            except prawcore.exceptions.ResponseException as response_error:
-                logger.error(response_error)
-                time.sleep(120)
+                await task()
+            except (prawcore.exceptions.ServerError,
+                    prawcore.exceptions.ResponseException) as error:
+                logger.error(error)
+                await asyncio.sleep(120)
             except Exception as error:
                 logger.error(error)
-                time.sleep(360)
-            
+                await asyncio.sleep(360)
+
+    async def run(self):
+        """Handles comments, sends replies, refreshes the data and posts the
+        price changes concurrently.
+        """
+        self.comment_queue = asyncio.Queue(
+            maxsize=self.config.get("QUEUE_SIZE", 100))
+        self.outbox_event = asyncio.Event()
+        self.loop = asyncio.get_event_loop()
+        await self.run_blocking(self.load_seen_comments)
+        self.start_comment_writer()
+
+        workers = [self.comment_worker()
+                   for _ in range(self.config.get("WORKERS", 4))]
+        await asyncio.gather(
+            self.keep_running(self.stream_comments),
+            self.keep_running(self.send_replies),
+            self.keep_running(self.refresh_data),
+            self.keep_running(self.watch_price_changes),
+            *workers
+        )
+
+
+async def main(config):
+    # Revalidate cached responses, so the latest prices are always used
+    async with create_session(ttl=0) as session:
+        fpl_bot = FPLBot(config, session)
+        if config.get("METRICS_PORT"):
+            start_metrics_server(config["METRICS_PORT"])
+        if config.get("METRICS_FILE"):
+            start_metrics_dump(config["METRICS_FILE"],
+                               config.get("METRICS_INTERVAL", 60))
+        # Load the results used for xGA before the first comment arrives
+        await fpl_bot.run_blocking(get_results_index)
+        await fpl_bot.run()
+
+
 if __name__ == "__main__":
     config = json.loads(open(f"{dirname}/../config.json").read())
     try:
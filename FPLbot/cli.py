@@ -0,0 +1,81 @@
+"""Command line interface of FPLbot.
+
+    python FPLbot/cli.py serve     runs the bot
+    python FPLbot/cli.py refresh   updates the players and results
+    python FPLbot/cli.py prices    posts today's price changes, if any
+    python FPLbot/cli.py lineups   watches the clubs' accounts for lineups
+    python FPLbot/cli.py migrate   moves the players' histories into their
+                                   own collections
+
+Each command only imports the modules it needs, so short-lived jobs (e.g.
+cron jobs) start quickly.
+"""
+import argparse
+import json
+import os
+
+dirname = os.path.dirname(os.path.realpath(__file__))
+
+
+def load_config(filename):
+    with open(f"{dirname}/../{filename}") as file:
+        return json.loads(file.read())
+
+
+def run(coroutine):
+    import asyncio
+
+    try:
+        asyncio.run(coroutine)
+    except AttributeError:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(coroutine)
+        loop.close()
+
+
+def serve(args):
+    import bot
+    run(bot.main(load_config("config.json")))
+
+
+def refresh(args):
+    import init
+    run(init.main())
+
+
+def prices(args):
+    import pricechange_time
+    run(pricechange_time.main(load_config("config.json")))
+
+
+def migrate(args):
+    import migrate
+    migrate.migrate()
+
+
+def lineups(args):
+    import starting_eleven
+    run(starting_eleven.main(load_config("twitter_config.json")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FPLbot")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    for command, help_text in ((serve, "run the bot"),
+                               (refresh, "update the players and results"),
+                               (prices, "post today's price changes"),
+                               (migrate, "move the players' histories into "
+                                         "their own collections"),
+                               (lineups, "watch the clubs' accounts for "
+                                         "lineups")):
+        subparser = subparsers.add_parser(command.__name__, help=help_text)
+        subparser.set_defaults(handler=command)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
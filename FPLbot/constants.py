@@ -75,7 +75,69 @@ desired_attributes = [
     "xGChain",
     "xGBuildup",
     "shots",
-    "understat_history"
+    "games",
+    "time"
+]
+
+# Fields compared with the stored values to decide whether a player has
+# played since the last update and their history needs to be fetched again.
+fpl_change_attributes = [
+    "event_points",
+    "minutes"
+]
+
+understat_change_attributes = [
+    "games",
+    "time",
+    "xG"
+]
+
+# Columns of a player's Understat match history and the types they are
+# parsed to at ingest.
+understat_int_columns = [
+    "time",
+    "goals",
+    "assists",
+    "npg",
+    "key_passes",
+    "h_goals",
+    "a_goals"
+]
+
+understat_float_columns = [
+    "xG",
+    "xA",
+    "npxG"
+]
+
+understat_str_columns = [
+    "id",
+    "date",
+    "season",
+    "position"
+]
+
+# Columns of the FPL history and Understat matches whose totals are shown in
+# the tables, and so are aggregated at ingest.
+fpl_total_columns = [
+    "minutes",
+    "total_points",
+    "bonus",
+    "goals_scored",
+    "assists",
+    "goals_conceded",
+    "saves"
+]
+
+understat_total_columns = [
+    "time",
+    "goals",
+    "assists",
+    "npg",
+    "key_passes",
+    "xG",
+    "xA",
+    "npxG"
 ]
 
 versus_pattern = re.compile(r"!fplbot\s+([A-zÀ-ÿ]+(?:[\s-][A-zÀ-ÿ]+)*)\s+(?:vs.|vs)\s+([A-zÀ-ÿ]+(?:[\s-][A-zÀ-ÿ]+)*)\s*(\d+)?")
@@ -213,3 +275,9 @@ lineup_markers = [
     ("line", "up"),
     ("team", "news")
 ]
+
+# Matches any of the lineup markers, e.g. "Line-up" or "TEAM NEWS"
+lineup_pattern = re.compile(
+    "|".join(r"\b" + r"[\s-]+".join(map(re.escape, marker)) + r"\b"
+             for marker in lineup_markers),
+    re.IGNORECASE)
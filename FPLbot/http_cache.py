@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.client import responses
+from urllib.parse import urlencode
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+dirname = os.path.dirname(os.path.realpath(__file__))
+
+# The cache can be configured using environment variables, so that cron jobs
+# and benchmarks can share (or replay) the same responses.
+CACHE_DIR = os.environ.get("FPLBOT_HTTP_CACHE_DIR",
+                           f"{dirname}/../.http_cache")
+CACHE_TTL = int(os.environ.get("FPLBOT_HTTP_CACHE_TTL", 300))
+REPLAY = os.environ.get("FPLBOT_HTTP_REPLAY", "") not in ("", "0")
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a response hasn't been recorded."""
+
+
+class CachedResponse:
+    """A response served from the cache, which supports the parts of
+    aiohttp.ClientResponse used by fpl and understat.
+    """
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # Hash of the body, which can be used to see if the content changed
+        self.digest = hashlib.sha256(body).hexdigest()
+
+    async def read(self):
+        return self.body
+
+    async def text(self, encoding=None):
+        return self.body.decode(encoding or "utf-8")
+
+    async def json(self, loads=json.loads, **kwargs):
+        return loads(self.body.decode("utf-8"))
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            # The error's string includes the URL of the request
+            request_info = aiohttp.RequestInfo(
+                URL(self.url), "GET", CIMultiDictProxy(CIMultiDict()))
+            raise aiohttp.ClientResponseError(
+                request_info, (), status=self.status,
+                message=responses.get(self.status, ""), headers=self.headers)
+
+    def release(self):
+        pass
+
+
+class CachedRequest:
+    """Async context manager returned by CachedSession.get(), mirroring
+    `async with session.get(url) as response`.
+    """
+    def __init__(self, coroutine):
+        self.coroutine = coroutine
+
+    def __await__(self):
+        return self.coroutine.__await__()
+
+    async def __aenter__(self):
+        return await self.coroutine
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class CachedSession:
+    """Wraps an aiohttp.ClientSession with a disk-backed cache of GET
+    responses.
+
+    Fresh responses (younger than `ttl` seconds) are served from disk, stale
+    ones are revalidated using conditional requests (ETag / Last-Modified),
+    and in replay mode only recorded responses are served, without using the
+    network at all. Response bodies are stored under the hash of their
+    content, so identical payloads are only stored once, and are removed
+    when no entry refers to them anymore. The cache's files are read and
+    written in threads, so the event loop isn't blocked.
+    """
+    def __init__(self, ttl=None, cache_dir=None, replay=None):
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.replay = REPLAY if replay is None else replay
+        self.session = None
+        # The number of entries referring to each body, which is counted the
+        # first time an entry is written.
+        self.references = None
+        self.lock = threading.Lock()
+
+        os.makedirs(f"{self.cache_dir}/entries", exist_ok=True)
+        os.makedirs(f"{self.cache_dir}/bodies", exist_ok=True)
+
+    async def __aenter__(self):
+        if not self.replay:
+            self.session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    def __getattr__(self, name):
+        # Anything other than GET (e.g. logging in) isn't cached
+        if name == "session":
+            raise AttributeError(name)
+        return getattr(self.session, name)
+
+    def get(self, url, **kwargs):
+        return CachedRequest(self.cached_get(url, **kwargs))
+
+    def entry_path(self, url, params):
+        if params:
+            url = f"{url}?{urlencode(sorted(dict(params).items()))}"
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return f"{self.cache_dir}/entries/{key}.json"
+
+    def body_path(self, digest):
+        return f"{self.cache_dir}/bodies/{digest}"
+
+    def load_entry(self, path):
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+            with open(self.body_path(entry["digest"]), "rb") as file:
+                body = file.read()
+        except (OSError, ValueError, KeyError):
+            return None, None
+        return entry, body
+
+    def read_digest(self, path):
+        """Returns the digest of the body the entry refers to, or None."""
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file).get("digest")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def count_references(self):
+        """Returns a Counter of the number of entries referring to each
+        body.
+        """
+        entries_dir = f"{self.cache_dir}/entries"
+        return Counter(
+            self.read_digest(f"{entries_dir}/{name}")
+            for name in os.listdir(entries_dir) if name.endswith(".json"))
+
+    def save_entry(self, path, entry, body=None):
+        """Stores the entry and its body, if given. The body the entry
+        referred to before is removed when no entry refers to it anymore, so
+        that not every version of e.g. the bootstrap is kept. If another
+        process still needs it, its entry is simply fetched again.
+        """
+        with self.lock:
+            if body is None:
+                write_atomically(path, json.dumps(entry).encode("utf-8"))
+                return
+
+            if self.references is None:
+                self.references = self.count_references()
+
+            body_path = self.body_path(entry["digest"])
+            if not os.path.exists(body_path):
+                write_atomically(body_path, body)
+
+            old_digest = self.read_digest(path)
+            write_atomically(path, json.dumps(entry).encode("utf-8"))
+            self.references[entry["digest"]] += 1
+            if old_digest is None:
+                return
+
+            self.references[old_digest] -= 1
+            if self.references[old_digest] <= 0:
+                del self.references[old_digest]
+                try:
+                    os.remove(self.body_path(old_digest))
+                except OSError:
+                    pass
+
+    async def run_in_thread(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def cached_get(self, url, params=None, headers=None, **kwargs):
+        path = self.entry_path(url, params)
+        entry, body = await self.run_in_thread(self.load_entry, path)
+
+        if self.replay:
+            if entry is None:
+                raise CacheMissError(f"No recorded response for GET {url}.")
+            return CachedResponse(url, entry["status"], entry["headers"], body)
+
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            return CachedResponse(url, entry["status"], entry["headers"], body)
+
+        headers = dict(headers or {})
+        if entry and entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry and entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+
+        async with self.session.get(url, params=params, headers=headers,
+                                    **kwargs) as response:
+            if response.status == 304 and entry:
+                entry["fetched_at"] = time.time()
+                await self.run_in_thread(self.save_entry, path, entry)
+                return CachedResponse(
+                    url, entry["status"], entry["headers"], body)
+
+            body = await response.read()
+            response_headers = {
+                header: response.headers[header]
+                for header in ("Content-Type", "ETag", "Last-Modified")
+                if header in response.headers
+            }
+
+            if response.status == 200:
+                entry = {
+                    "url": url,
+                    "status": response.status,
+                    "headers": response_headers,
+                    "digest": hashlib.sha256(body).hexdigest(),
+                    "fetched_at": time.time()
+                }
+                await self.run_in_thread(self.save_entry, path, entry, body)
+
+            return CachedResponse(
+                url, response.status, response_headers, body)
+
+
+def write_atomically(path, data):
+    """Writes the data to the given path, so that concurrent readers never
+    see a partially written file.
+    """
+    temporary_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+    os.replace(temporary_path, path)
+
+
+def create_session(ttl=None):
+    """Returns a session with a disk-backed response cache, for use instead of
+    aiohttp.ClientSession().
+    """
+    return CachedSession(ttl=ttl)
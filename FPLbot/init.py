@@ -1,12 +1,7 @@
 import asyncio
 
-from pymongo import MongoClient
-
 from utils import update_players, update_results
 
-client = MongoClient()
-database = client.fpl
-
 
 async def main():
     await update_players()
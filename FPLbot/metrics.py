@@ -0,0 +1,164 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger("FPLbot")
+
+# Upper bounds (in seconds) of the latency histograms' buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+           30, 60, 300)
+
+
+class Histogram:
+    """Cumulative histogram of durations, like Prometheus' histograms."""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, quantile):
+        """Returns the upper bound of the bucket containing the quantile."""
+        if not self.count:
+            return 0.0
+
+        rank = quantile * self.count
+        for bound, count in zip(BUCKETS, self.counts):
+            if count >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Thread-safe collection of counters and per-stage latency histograms."""
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        """Times the enclosed block as the given stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorator that times each call of a (coroutine) function as the
+        given stage.
+        """
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    with self.span(stage):
+                        return await function(*args, **kwargs)
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    with self.span(stage):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: {
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99)
+                    } for stage, histogram in self.histograms.items()
+                }
+            }
+
+    def to_prometheus(self):
+        """Returns the metrics in Prometheus' text exposition format."""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE fplbot_{name}_total counter")
+                lines.append(f"fplbot_{name}_total {value}")
+
+            lines.append("# TYPE fplbot_stage_duration_seconds histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                label = f'stage="{stage}"'
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    lines.append(f"fplbot_stage_duration_seconds_bucket"
+                                 f'{{{label},le="{bound}"}} {count}')
+                lines.append(f"fplbot_stage_duration_seconds_bucket"
+                             f'{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f"fplbot_stage_duration_seconds_sum{{{label}}} "
+                             f"{histogram.sum}")
+                lines.append(f"fplbot_stage_duration_seconds_count{{{label}}} "
+                             f"{histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """Serves the metrics in Prometheus' format on the given port."""
+    server = HTTPServer(("", port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics on port {port}.")
+    return server
+
+
+def start_metrics_dump(path, interval=60):
+    """Writes the metrics as JSON to the given path every `interval`
+    seconds.
+    """
+    def dump():
+        while True:
+            time.sleep(interval)
+            try:
+                with open(path, "w") as file:
+                    json.dump(metrics.to_json(), file, indent=2)
+            except OSError as error:
+                logger.error(f"Could not write metrics: {error}")
+
+    thread = threading.Thread(target=dump, daemon=True)
+    thread.start()
+    return thread
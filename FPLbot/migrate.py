@@ -0,0 +1,66 @@
+"""Moves the FPL history and Understat matches that used to be stored in each
+player's document into the fpl_history and understat_matches collections.
+Players that have already been migrated are skipped, so it can be run again
+if it was interrupted.
+"""
+from repository import create_indexes, get_database
+from utils import (bump_data_version, create_logger, fpl_history_requests,
+                   materialize_aggregates, understat_match_requests)
+
+database = get_database("fpl")
+logger = create_logger()
+
+# Fields of the old player documents that are no longer stored in them
+LEGACY_FIELDS = ["history", "fixtures", "history_past", "understat_history",
+                 "understat_columns"]
+BATCH_SIZE = 50
+
+
+def migrate_players(players):
+    """Stores the histories of the given players in their own collections,
+    and then removes them from the players' documents.
+    """
+    history_requests = []
+    match_requests = []
+    for player in players:
+        history_requests += fpl_history_requests(
+            player["id"], player.get("history", []))
+        match_requests += understat_match_requests(
+            player["id"], player.get("understat_history", []))
+
+    if history_requests:
+        database.fpl_history.bulk_write(history_requests, ordered=False)
+    if match_requests:
+        database.understat_matches.bulk_write(match_requests, ordered=False)
+
+    database.players.update_many(
+        {"id": {"$in": [player["id"] for player in players]}},
+        {"$unset": {field: "" for field in LEGACY_FIELDS}})
+
+
+def migrate():
+    create_indexes()
+    legacy_players = database.players.find(
+        {"$or": [{field: {"$exists": True}} for field in LEGACY_FIELDS]},
+        {"_id": 0, "id": 1, "history": 1, "understat_history": 1})
+
+    number_of_players = 0
+    batch = []
+    for player in legacy_players:
+        batch.append(player)
+        if len(batch) == BATCH_SIZE:
+            migrate_players(batch)
+            number_of_players += len(batch)
+            batch = []
+
+    if batch:
+        migrate_players(batch)
+        number_of_players += len(batch)
+
+    materialize_aggregates()
+    bump_data_version("players")
+    logger.info(f"Migrated {number_of_players} players.")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,124 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+from constants import player_dict
+
+# Minimum trigram similarity for a name to be considered a match
+SIMILARITY_THRESHOLD = 0.3
+
+# Names that people actually use rank above first names, e.g. "mo" should
+# find the player called Mo and not every Mohamed in the game.
+NAME_WEIGHTS = {
+    "web_name": 1.0,
+    "full_name": 1.0,
+    "alias": 1.0,
+    "second_name": 0.9,
+    "first_name": 0.8
+}
+
+
+def normalise_name(name):
+    """Returns the name in lower case, without accents or punctuation, so
+    that e.g. "mane" and "Mané" are equal.
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r"['’]", "", name.lower())
+    name = re.sub(r"[^a-z0-9]+", " ", name)
+    return name.strip()
+
+
+def to_trigrams(name):
+    """Returns the set of trigrams of the given (normalised) name."""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlayerNameIndex:
+    """In-memory index of the names of all players, which ranks players by
+    how similar their names are to a search query.
+    """
+    def __init__(self, players):
+        self.names = []
+        self.exact_names = defaultdict(list)
+        self.trigram_index = defaultdict(set)
+        self.ownership = {}
+
+        # Understat names of players mapped to their full FPL names
+        aliases = defaultdict(list)
+        for understat_name, fpl_name in player_dict.items():
+            aliases[normalise_name(fpl_name)].append(understat_name)
+
+        for player in players:
+            full_name = f"{player['first_name']} {player['second_name']}"
+            names = [
+                (player["web_name"], "web_name"),
+                (player["first_name"], "first_name"),
+                (player["second_name"], "second_name"),
+                (full_name, "full_name")
+            ]
+            names += [(alias, "alias")
+                      for alias in aliases[normalise_name(full_name)]]
+
+            for name, kind in names:
+                self.add_name(player["id"], normalise_name(name), kind)
+
+            self.ownership[player["id"]] = float(
+                player.get("selected_by_percent", 0))
+
+    def add_name(self, player_id, name, kind):
+        if not name:
+            return
+
+        position = len(self.names)
+        trigrams = to_trigrams(name)
+        self.names.append((player_id, trigrams, NAME_WEIGHTS[kind]))
+        self.exact_names[name].append(position)
+
+        for trigram in trigrams:
+            self.trigram_index[trigram].add(position)
+
+    def search(self, query, limit=5):
+        """Returns the IDs of the players whose names best match the query,
+        ordered from most to least relevant.
+        """
+        return [player_id for player_id, _ in self.rank(query)[:limit]]
+
+    def rank(self, query):
+        """Returns (player ID, score) tuples of the players whose names match
+        the query, ordered from most to least relevant.
+        """
+        query = normalise_name(query)
+        if not query:
+            return []
+
+        scores = {}
+
+        def add_score(position, score):
+            player_id, _, weight = self.names[position]
+            score *= weight
+            if score > scores.get(player_id, 0):
+                scores[player_id] = score
+
+        # Exact matches always rank above fuzzy matches
+        for position in self.exact_names.get(query, []):
+            add_score(position, 2.0)
+
+        query_trigrams = to_trigrams(query)
+        shared_trigrams = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self.trigram_index.get(trigram, ()):
+                shared_trigrams[position] += 1
+
+        for position, shared in shared_trigrams.items():
+            name_trigrams = self.names[position][1]
+            similarity = shared / (
+                len(query_trigrams) + len(name_trigrams) - shared)
+            if similarity >= SIMILARITY_THRESHOLD:
+                add_score(position, similarity)
+
+        # Break ties by picking the most owned player
+        ranking = sorted(scores, key=lambda player_id: (
+            -scores[player_id], -self.ownership[player_id]))
+        return [(player_id, scores[player_id]) for player_id in ranking]
@@ -1,35 +1,29 @@
 import asyncio
 import json
-import logging
 import os
-import re
-from datetime import datetime
 
-import aiohttp
-import praw
 from fpl import FPL
-from fpl.utils import position_converter
-from pymongo import MongoClient
 
 from bot import FPLBot
+from http_cache import create_session
+from utils import update_players
 
 dirname = os.path.dirname(os.path.realpath(__file__))
-client = MongoClient()
 
 
 async def main(config):
-    """Returns a list of players whose price has changed since the last
-    time the database was updated.
-    """
-    database = client.fpl
-    async with aiohttp.ClientSession() as session:
+    """Posts today's price changes, if they haven't been posted yet."""
+    # Always revalidate the cached bootstrap, so new prices aren't missed
+    async with create_session(ttl=0) as session:
         fpl = FPL(session)
         fpl_bot = FPLBot(config, session)
         has_already_posted = await fpl_bot.has_posted_price_change()
         
         if not has_already_posted:
-            new_players = await fpl.get_players(include_summary=True)
-            await fpl_bot.post_price_changes(new_players)
+            # Summaries are only fetched for the risers and fallers
+            new_players = await fpl.get_players()
+            if await fpl_bot.post_price_changes(new_players):
+                await update_players()
 
 if __name__ == "__main__":
     with open(f"{dirname}/../config.json") as file:
@@ -39,4 +33,4 @@ if __name__ == "__main__":
         except AttributeError:
             loop = asyncio.get_event_loop()
             loop.run_until_complete(main(config))
-            loop.close()
\ No newline at end of file
+            loop.close()
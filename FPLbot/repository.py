@@ -0,0 +1,213 @@
+import os
+import threading
+
+from constants import (fpl_team_names, fpl_total_columns,
+                       understat_float_columns, understat_int_columns,
+                       understat_str_columns)
+
+# The connection can be configured using environment variables, so that the
+# bot, cron jobs and benchmarks can use the same settings.
+MONGODB_URI = os.environ.get("FPLBOT_MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_POOL_SIZE = int(os.environ.get("FPLBOT_MONGODB_POOL_SIZE", 50))
+
+# Fields of a player needed to look them up by name
+NAME_FIELDS = ["id", "web_name", "first_name", "second_name",
+               "selected_by_percent"]
+# Fields of a player needed to find the price changes
+COST_FIELDS = ["id", "now_cost"]
+# Fields of each fixture in a player's FPL history used by the tables
+HISTORY_FIELDS = ["fixture", "was_home", *fpl_total_columns]
+# Fields of each of a player's Understat matches shown in the tables
+MATCH_FIELDS = (understat_int_columns + understat_float_columns +
+                understat_str_columns + ["h_team", "a_team", "teams"])
+# Fields of a player needed to build the tables of a reply
+TABLE_FIELDS = ["id", "web_name", "now_cost", "team", "element_type"]
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the MongoClient shared by all modules, which is only created
+    (and connected) the first time it is used. Its connection pool is shared
+    by all threads.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from pymongo import MongoClient
+                _client = MongoClient(MONGODB_URI,
+                                      maxPoolSize=MONGODB_POOL_SIZE,
+                                      appname="FPLbot")
+    return _client
+
+
+class LazyDatabase:
+    """Stands in for a pymongo Database, so modules can create their database
+    at import time without connecting to MongoDB.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        return getattr(get_client()[self.name], attribute)
+
+    def __getitem__(self, collection):
+        return get_client()[self.name][collection]
+
+
+def get_database(name="fpl"):
+    return LazyDatabase(name)
+
+
+database = get_database("fpl")
+
+
+def projection(fields):
+    """Returns a projection including only the given fields."""
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+def get_name_lookup_players():
+    """Returns the ID, names and ownership of every player."""
+    return list(database.players.find({}, projection(NAME_FIELDS)))
+
+
+def get_player_costs(collection="players"):
+    """Returns a dict mapping the ID of each player in the collection to
+    their cost.
+    """
+    return {player["id"]: player["now_cost"]
+            for player in database[collection].find(
+                {}, projection(COST_FIELDS))}
+
+
+def create_indexes():
+    """Creates the indexes used by the queries below, if they don't exist."""
+    database.players.create_index("id")
+    database.fpl_history.create_index(
+        [("player_id", 1), ("fixture", 1)], unique=True)
+    database.fpl_history.create_index(
+        [("player_id", 1), ("kickoff_time", -1)])
+    database.fpl_history.create_index(
+        [("player_id", 1), ("opponent_team", 1)])
+    database.understat_matches.create_index(
+        [("player_id", 1), ("id", 1)], unique=True)
+    database.understat_matches.create_index([("player_id", 1), ("date", -1)])
+    database.understat_matches.create_index(
+        [("player_id", 1), ("teams", 1), ("date", -1)])
+    database.understat_matches.create_index("id")
+    database.player_aggregates.create_index("player_id", unique=True)
+
+
+def get_table_player(player_id):
+    """Returns the player with only the fields used to build the tables of a
+    reply, or None if they don't exist.
+    """
+    return database.players.find_one(
+        {"id": player_id}, projection(TABLE_FIELDS))
+
+
+def get_fpl_history(player_id, limit):
+    """Returns the player's FPL history of the last `limit` fixtures they
+    played in, oldest first.
+    """
+    history = database.fpl_history.find(
+        {"player_id": player_id, "minutes": {"$gt": 0}},
+        projection(HISTORY_FIELDS)
+    ).sort("kickoff_time", -1).limit(limit)
+    return list(history)[::-1]
+
+
+def get_understat_matches(player_id, team=None, fixture_ids=None, limit=0):
+    """Returns the Understat matches the player played in, most recent first.
+    If `team` is given, only the Premier League matches against (or for)
+    that team are returned, and if `fixture_ids` is given only the matches
+    with those IDs.
+    """
+    query = {"player_id": player_id, "time": {"$gt": 0}}
+    if team:
+        query["teams"] = {"$all": [team], "$in": fpl_team_names}
+    if fixture_ids is not None:
+        query["id"] = {"$in": list(fixture_ids)}
+
+    return list(database.understat_matches.find(
+        query, projection(MATCH_FIELDS)).sort("date", -1).limit(limit))
+
+
+def players_query(player_ids, field="player_id"):
+    """Returns a query matching the given players, or all players if
+    `player_ids` is None.
+    """
+    if player_ids is None:
+        return {}
+    return {field: {"$in": list(player_ids)}}
+
+
+def get_player_teams(player_ids=None):
+    """Returns a dict mapping the ID of each of the given players (or all
+    players) to their team.
+    """
+    players = database.players.find(players_query(player_ids, "id"),
+                                    projection(["id", "team"]))
+    return {player["id"]: player["team"] for player in players}
+
+
+def get_all_fpl_history(player_ids=None):
+    """Returns the FPL history of the given players (or all players) of the
+    fixtures they played in, sorted by player and then most recent first.
+    """
+    return database.fpl_history.find(
+        {**players_query(player_ids), "minutes": {"$gt": 0}},
+        projection(["player_id", *HISTORY_FIELDS])
+    ).sort([("player_id", 1), ("kickoff_time", -1)])
+
+
+def get_all_understat_matches(player_ids=None):
+    """Returns the Understat matches the given players (or all players)
+    played in, sorted by player and then most recent first.
+    """
+    return database.understat_matches.find(
+        {**players_query(player_ids), "time": {"$gt": 0}},
+        projection(["player_id", *MATCH_FIELDS])
+    ).sort([("player_id", 1), ("date", -1)])
+
+
+def get_match_player_ids(match_ids):
+    """Returns the IDs of the players who played in the given Understat
+    matches.
+    """
+    if not match_ids:
+        return []
+    return database.understat_matches.distinct(
+        "player_id", {"id": {"$in": list(match_ids)}})
+
+
+def get_aggregated_player_ids(version):
+    """Returns a set containing the IDs of the players whose aggregates are of
+    the given version.
+    """
+    return {aggregates["player_id"] for aggregates in
+            database.player_aggregates.find({"version": version},
+                                            projection(["player_id"]))}
+
+
+def get_player_aggregates(player_id, groups):
+    """Returns the given groups of the player's aggregates (see
+    aggregates.py), or None if they haven't been materialized.
+    """
+    return database.player_aggregates.find_one(
+        {"player_id": player_id}, projection(["version", *groups]))
+
+
+def get_opponent_aggregates(player_id, team, version):
+    """Returns the aggregates of the player's matches against the given team,
+    or None if there aren't any (of the given version).
+    """
+    aggregates = database.player_aggregates.find_one(
+        {"player_id": player_id, "version": version},
+        {"_id": 0, "opponents": {"$elemMatch": {"team": team}}})
+    if not aggregates or not aggregates.get("opponents"):
+        return None
+    return aggregates["opponents"][0]
@@ -1,18 +1,32 @@
 import asyncio
 import json
+import logging
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
 
-import aiohttp
 import tweepy
 from dateutil.parser import parse
-from fpl import FPL, utils
-from pymongo import MongoClient
-from constants import lineup_markers, twitter_usernames
+from fpl.constants import API_URLS
+from fpl.models.fixture import Fixture
+from constants import lineup_pattern, twitter_usernames
+from http_cache import create_session
+from repository import get_database
 
 dirname = os.path.dirname(os.path.realpath(__file__))
-client = MongoClient()
-database = client.team_news
+database = get_database("team_news")
+logger = logging.getLogger("FPLbot")
+
+# Lineups are announced about an hour before kick-off, when FPL has no
+# team_news_time for a fixture
+TEAM_NEWS_OFFSET = timedelta(minutes=75)
+# How long before the team news is due the accounts are checked
+LINEUP_LEAD = timedelta(minutes=2)
+# The longest (in seconds) it waits before trying again after an error
+MAX_RETRY_DELAY = 600
+
+# Upcoming fixtures, cached until FPL's fixture data changes
+_schedule = {"digest": None, "fixtures": []}
 
 
 def short_name_converter(team_id):
@@ -43,17 +57,31 @@ def short_name_converter(team_id):
     return short_name_map[team_id]
 
 
-async def get_current_fixtures():
-    async with aiohttp.ClientSession() as session:
-        fpl = FPL(session)
-        current_gameweek = await utils.get_current_gameweek(session)
-        fixtures = await fpl.get_fixtures_by_gameweek(current_gameweek)
+def get_team_news_time(fixture):
+    """Returns the time the fixture's lineups are expected to be announced."""
+    if fixture.get("team_news_time"):
+        return parse(fixture["team_news_time"])
+    return parse(fixture["kickoff_time"]) - TEAM_NEWS_OFFSET
+
 
-    min_range = timedelta(minutes=2)
-    return [fixture for fixture in fixtures
-            if fixture.team_news_time.replace(tzinfo=None) - min_range <
-            datetime.now() <
-            fixture.team_news_time.replace(tzinfo=None) + min_range]
+async def get_schedule(session):
+    """Returns the upcoming fixtures with the time their team news is
+    expected, sorted by that time. The response is revalidated using a
+    conditional request, and the schedule is only rebuilt when FPL's fixture
+    data has changed.
+    """
+    async with session.get(API_URLS["fixtures"],
+                           params={"future": 1}) as response:
+        response.raise_for_status()
+        if response.digest != _schedule["digest"]:
+            fixtures = await response.json()
+            _schedule["fixtures"] = sorted([
+                (get_team_news_time(fixture), Fixture(fixture))
+                for fixture in fixtures if fixture.get("kickoff_time")
+            ], key=lambda item: item[0])
+            _schedule["digest"] = response.digest
+
+    return _schedule["fixtures"]
 
 
 def is_new_lineup(fixture_id, team_id):
@@ -64,8 +92,8 @@ def is_new_lineup(fixture_id, team_id):
 
 
 def add_lineup_to_database(fixture_id, team_id, url):
-    self.database.lineup.update_one(
-        {"fixture_id": fixture_id},
+    database.lineup.update_one(
+        {"fixture_id": fixture_id, "team_id": team_id},
         {"$set": {"fixture_id": fixture_id,
                   "team_id": team_id,
                   "url": url}},
@@ -73,41 +101,162 @@ def add_lineup_to_database(fixture_id, team_id, url):
     )
 
 
-def lineup_handler(team_id, team_short_name, opponent_id):
-    team_name = twitter_usernames[team_short_name]
-    for status in api.user_timeline(screen_name=team_name,
-                                    tweet_mode="extended",
-                                    count=3):
+def get_since_id(screen_name):
+    """Returns the ID of the newest tweet of the account that has already
+    been checked.
+    """
+    cursor = database.cursors.find_one({"screen_name": screen_name},
+                                       {"_id": 0, "since_id": 1})
+    return cursor["since_id"] if cursor else None
+
+
+def set_since_id(screen_name, since_id):
+    database.cursors.update_one(
+        {"screen_name": screen_name},
+        {"$max": {"since_id": since_id}},
+        upsert=True
+    )
+
+
+def get_new_statuses(api, screen_name):
+    """Returns the account's tweets that haven't been checked yet, newest
+    first. The first time only its latest tweets are checked.
+    """
+    since_id = get_since_id(screen_name)
+    if since_id:
+        statuses = api.user_timeline(screen_name=screen_name,
+                                     since_id=since_id,
+                                     tweet_mode="extended",
+                                     count=200)
+    else:
+        statuses = api.user_timeline(screen_name=screen_name,
+                                     tweet_mode="extended",
+                                     count=3)
+
+    if statuses:
+        set_since_id(screen_name, max(status.id for status in statuses))
+    return statuses
 
-        status_split = status.full_text.lower().replace("-", " ").split()
 
-        for marker in lineup_markers:
-            if marker in list(zip(split_status, split_status[1:])):
-                if "media" not in status.entities:
-                    continue
-                media = status.entities["media"][0]
-                media_url = media["media_url_https"]
-                if is_new_lineup(fixture.id, team_id):
-                    add_lineup_to_database(fixture.id, team_id, media_url)
-                return
+def find_lineup(statuses, team_news_time):
+    """Returns the URL of the image of the newest lineup in the tweets. Tweets
+    from before the fixture's team news was due are ignored, so e.g. the
+    previous fixture's lineup isn't used.
+    """
+    for status in statuses:
+        created_at = status.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if created_at < team_news_time - LINEUP_LEAD:
+            continue
+        if not lineup_pattern.search(status.full_text):
+            continue
+        if "media" not in status.entities:
+            continue
+        return status.entities["media"][0]["media_url_https"]
+    return None
 
 
-async def main(config):
+def lineup_handler(api, fixture_id, team_id, team_news_time):
+    """Adds the team's lineup for the fixture to the database, if it has been
+    tweeted since the team's account was last checked.
+    """
+    if not is_new_lineup(fixture_id, team_id):
+        return
+
+    screen_name = twitter_usernames[short_name_converter(team_id)]
+    media_url = find_lineup(get_new_statuses(api, screen_name),
+                            team_news_time)
+    if media_url:
+        add_lineup_to_database(fixture_id, team_id, media_url)
+
+
+async def check_lineups(api, fixtures):
+    """Checks the accounts of all teams playing in the fixtures, given as
+    (team_news_time, fixture) pairs, concurrently. Tweepy is blocking, so
+    each account is checked in a thread.
+    """
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(*[
+        loop.run_in_executor(None, lineup_handler, api, fixture.id, team_id,
+                             team_news_time)
+        for team_news_time, fixture in fixtures
+        for team_id in (fixture.team_h, fixture.team_a)
+    ])
+
+
+def create_api(config):
+    """Returns the Twitter API. TWITTER_API_HOST can be used to point it at
+    a stand-in for the Twitter API.
+    """
     auth = tweepy.OAuthHandler(config["CONSUMER_API_KEY"],
                                config["CONSUMER_API_SECRET_KEY"])
     auth.set_access_token(config["ACCESS_TOKEN"],
                           config["ACCESS_TOKEN_SECRET"])
-    api = tweepy.API(auth)
+    return tweepy.API(
+        auth, host=config.get("TWITTER_API_HOST", "api.twitter.com"))
+
+
+async def watch_lineups(config, api, session):
+    """Sleeps until the team news of the next fixture is due, and then checks
+    the teams' accounts every LINEUP_POLL_INTERVAL seconds until
+    LINEUP_WINDOW seconds after it was due. The schedule is refreshed every
+    SCHEDULE_REFRESH_INTERVAL seconds. After something went wrong it tries
+    again after LINEUP_RETRY_DELAY seconds, doubling each time it fails
+    again.
+    """
+    poll_interval = config.get("LINEUP_POLL_INTERVAL", 15)
+    window = timedelta(seconds=config.get("LINEUP_WINDOW", 1800))
+    refresh_interval = config.get("SCHEDULE_REFRESH_INTERVAL", 3600)
+    retry_delay = config.get("LINEUP_RETRY_DELAY", 60)
+    refreshed_at = None
+    failures = 0
+
+    while True:
+        try:
+            if (refreshed_at is None or
+                    time.monotonic() - refreshed_at >= refresh_interval):
+                schedule = await get_schedule(session)
+                refreshed_at = time.monotonic()
+
+            now = datetime.now(timezone.utc)
+            due_fixtures = [
+                (team_news_time, fixture)
+                for team_news_time, fixture in schedule
+                if (team_news_time - LINEUP_LEAD <= now <=
+                    team_news_time + window)
+            ]
+            if due_fixtures:
+                await check_lineups(api, due_fixtures)
+                delay = poll_interval
+            else:
+                delay = refresh_interval - (time.monotonic() - refreshed_at)
+                upcoming = [team_news_time - LINEUP_LEAD
+                            for team_news_time, _ in schedule
+                            if team_news_time - LINEUP_LEAD > now]
+                if upcoming:
+                    delay = min(delay, (upcoming[0] - now).total_seconds())
+            failures = 0
+        except Exception as error:
+            # E.g. FPL's API is being updated, or Twitter's API is unavailable
+            delay = min(retry_delay * 2 ** failures, MAX_RETRY_DELAY)
+            failures += 1
+            logger.error(f"Could not check the lineups: {error}. Trying "
+                         f"again in {delay} seconds.")
+
+        await asyncio.sleep(max(0, delay))
 
-    current_fixtures = await get_current_fixtures()
-    images_urls = []
 
-    for fixture in current_fixtures:
-        team_h_short = short_name_converter(fixture.team_h)
-        team_a_short = short_name_converter(fixture.team_a)
+async def main(config, api=None):
+    # Imported here, so importing this module doesn't import utils' heavier
+    # dependencies
+    from utils import create_logger
+    create_logger()
 
-        lineup_handler(fixture.team_h, team_h_short, fixture.team_a)
-        lineup_handler(fixture.team_a, team_a_short, fixture.team_h)
+    api = api or create_api(config)
+    # Always revalidate the fixtures, so changes to the schedule are seen
+    async with create_session(ttl=0) as session:
+        await watch_lineups(config, api, session)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+ALIGNMENTS = {
+    "left": ":-",
+    "center": ":-:",
+    "right": "-:"
+}
+
+
+class Column:
+    """A column of a Markdown table.
+
+    `cell` returns the column's (formatted) value for a row, and `total`
+    optionally returns the (formatted) value shown in the table's footer for
+    all of its rows.
+    """
+    def __init__(self, header, cell, align="right", total=None):
+        self.header = header
+        self.cell = cell
+        self.align = ALIGNMENTS[align]
+        self.total = total
+
+
+def render_table(columns, rows):
+    """Returns a Markdown pipe table of the given rows. The cells aren't
+    padded, since Reddit doesn't need them to be aligned. If any column has
+    a total, a footer with the totals in bold is added.
+    """
+    lines = [
+        f"|{'|'.join(column.header for column in columns)}|",
+        f"|{'|'.join(column.align for column in columns)}|"
+    ]
+    lines += [f"|{'|'.join([column.cell(row) for column in columns])}|"
+              for row in rows]
+
+    if any(column.total for column in columns):
+        footer = "|".join([f"**{column.total(rows)}**" if column.total else ""
+                           for column in columns])
+        lines.append(f"|{footer}|")
+
+    return "\n".join(lines)
+
+
+def sum_column(value, float_format=None):
+    """Returns a function that sums the value of each row, for use as the
+    total of a column.
+    """
+    def total(rows):
+        result = sum(value(row) for row in rows)
+        if float_format:
+            return f"{result:{float_format}}"
+        return str(result)
+
+    return total
+
+
+def fixed_total(total, float_format=None):
+    """Returns a function that returns the given (precomputed) total, for use
+    as the total of a column.
+    """
+    if float_format:
+        total = f"{total:{float_format}}"
+    else:
+        total = str(total)
+    return lambda rows: total
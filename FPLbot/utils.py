@@ -1,25 +1,61 @@
 import asyncio
 import codecs
+import functools
 import json
 import logging
 import os
+import random
 import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from itertools import groupby
+from operator import itemgetter
 
 from fpl import FPL
 from fpl.utils import position_converter, team_converter
-from pymongo import MongoClient, ReplaceOne
+from pymongo import DeleteMany, ReplaceOne, ReturnDocument, UpdateOne
 
 import aiohttp
-from bs4 import BeautifulSoup
-from constants import (desired_attributes, fpl_team_names, player_dict,
-                       team_dict, to_fpl_team_dict)
-from tabulate import tabulate
+from aggregates import covers, create_group, window_totals
+from constants import (desired_attributes, fpl_change_attributes,
+                       fpl_team_names, fpl_total_columns, player_dict,
+                       team_dict, to_fpl_team_dict,
+                       understat_change_attributes,
+                       understat_float_columns, understat_int_columns,
+                       understat_str_columns, understat_total_columns)
+from http_cache import create_session
+from metrics import metrics
+from name_index import PlayerNameIndex, normalise_name
+from repository import (create_indexes, get_aggregated_player_ids,
+                        get_all_fpl_history, get_all_understat_matches,
+                        get_database, get_fpl_history, get_match_player_ids,
+                        get_name_lookup_players, get_opponent_aggregates,
+                        get_player_aggregates, get_player_teams,
+                        get_table_player, get_understat_matches)
+from tables import Column, fixed_total, render_table, sum_column
 from understat import Understat
 
-client = MongoClient()
-database = client.fpl
+database = get_database("fpl")
 logger = logging.getLogger("FPLbot")
 
+# How long (in seconds) a collection's data version is trusted before it is
+# read from the database again.
+DATA_VERSION_TTL = 60
+_data_versions = {}
+_player_index = {"version": None, "index": None}
+_results_index = {"version": None, "results": None, "ids": None}
+
+# Limits used when fetching data from Understat, which throttles bursts of
+# requests by returning pages without any data.
+UNDERSTAT_CONCURRENCY = 10
+UNDERSTAT_RETRIES = 5
+UNDERSTAT_BACKOFF = 1
+
+# Version of the format of the players' aggregates, which is bumped when it
+# changes so that outdated aggregates aren't used.
+AGGREGATES_VERSION = 2
+
 
 def create_logger():
     """Creates a logger object for use in logging across all files.
@@ -48,6 +84,127 @@ def create_logger():
     return logger
 
 
+async def run_blocking(function, *args, executor=None, **kwargs):
+    """Runs the blocking function (e.g. a pymongo query) in a thread of the
+    given executor, or the event loop's default one, so that the event loop
+    isn't blocked while it runs.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(function, *args, **kwargs))
+
+
+def get_data_version(collection):
+    """Returns the data version of the given collection, which is bumped
+    every time it is updated (possibly by another process).
+    """
+    version, checked_at = _data_versions.get(collection, (None, 0))
+    if time.monotonic() - checked_at > DATA_VERSION_TTL:
+        document = database.versions.find_one({"_id": collection}) or {}
+        version = document.get("version", 0)
+        _data_versions[collection] = (version, time.monotonic())
+    return version
+
+
+def bump_data_version(collection):
+    """Increments the data version of the given collection, invalidating
+    everything that was cached using its data.
+    """
+    document = database.versions.find_one_and_update(
+        {"_id": collection},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _data_versions[collection] = (document["version"], time.monotonic())
+
+
+def get_player_index():
+    """Returns the index of player names, which is rebuilt whenever the
+    players in the database have been updated.
+    """
+    version = get_data_version("players")
+    if _player_index["index"] is None or _player_index["version"] != version:
+        _player_index["index"] = PlayerNameIndex(get_name_lookup_players())
+        _player_index["version"] = version
+    return _player_index["index"]
+
+
+def index_result(result):
+    """Returns the home team of the result and the xG of both teams."""
+    return (result["h"]["title"], float(result["xG"]["h"]),
+            float(result["xG"]["a"]))
+
+
+def load_results_index():
+    """Returns a dict mapping the ID of each of this season's results to its
+    home team and the xG of both teams.
+    """
+    results = database.results.find(
+        {}, {"_id": 0, "id": 1, "h.title": 1, "xG": 1})
+    return {result["id"]: index_result(result) for result in results}
+
+
+def get_results_index():
+    """Returns a dict mapping the ID of each of this season's results to its
+    home team and the xG of both teams. It is reloaded whenever the results
+    in the database have been updated.
+    """
+    version = get_data_version("results")
+    if (_results_index["results"] is None or
+            _results_index["version"] != version):
+        _results_index["results"] = load_results_index()
+        _results_index["ids"] = frozenset(_results_index["results"])
+        _results_index["version"] = version
+    return _results_index["results"]
+
+
+def get_result_ids():
+    """Returns a set containing the IDs of this season's results."""
+    get_results_index()
+    return _results_index["ids"]
+
+
+class ReplyCache:
+    """Thread-safe LRU cache of rendered replies whose entries expire after
+    the given number of seconds.
+    """
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+def get_reply_cache_key(*args):
+    """Returns a key for the reply cache which includes the current version
+    of the data used to render replies, so that entries are invalidated
+    automatically after each data refresh.
+    """
+    return (*args, get_data_version("players"), get_data_version("results"))
+
+
 async def fetch(session, url):
     async with session.get(url) as response:
         return await response.text()
@@ -69,242 +226,714 @@ async def understat_players_data(session):
     return player_data
 
 
-async def understat_matches_data(session, player):
+async def understat_matches_data(session, player, semaphore, timings):
     """Sets the 'matches' attribute of the given player to the data found on
     https://understat.com/player/<player_id>.
     """
+    understat = Understat(session)
 
-    try:
-        understat = Understat(session)
-        matches_data = await understat.get_player_matches(player["id"])
-        for fixture in matches_data:
-            fixture["h_team"] = understat_team_converter(fixture["h_team"])
-            fixture["a_team"] = understat_team_converter(fixture["a_team"])
+    for attempt in range(UNDERSTAT_RETRIES):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                matches_data = await understat.get_player_matches(
+                    player["id"])
+            # Understat raises UnboundLocalError when it has been throttled
+            except (UnboundLocalError, aiohttp.ClientError,
+                    asyncio.TimeoutError) as error:
+                timings.append(time.monotonic() - start)
+                metrics.observe("understat_request", timings[-1])
+                metrics.increment("understat_requests_failed")
+                logger.warning(f"Fetching Understat player {player['id']} "
+                               f"failed (attempt {attempt + 1}): {error!r}")
+            else:
+                timings.append(time.monotonic() - start)
+                metrics.observe("understat_request", timings[-1])
+                for fixture in matches_data:
+                    fixture["h_team"] = understat_team_converter(
+                        fixture["h_team"])
+                    fixture["a_team"] = understat_team_converter(
+                        fixture["a_team"])
+
+                player["understat_history"] = matches_data
+                return player
+
+        # Exponential backoff with full jitter
+        await asyncio.sleep(random.uniform(0, UNDERSTAT_BACKOFF * 2 ** attempt))
+
+    logger.error(f"Could not fetch Understat player {player['id']} after "
+                 f"{UNDERSTAT_RETRIES} attempts.")
+    return player
 
-        player["understat_history"] = matches_data
-    except UnboundLocalError:
-        await understat_matches_data(session, player)
 
-    return player
+def log_request_timings(name, timings):
+    """Logs the number of requests made and their latency."""
+    if not timings:
+        return
+
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2]
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    logger.info(f"{name}: {len(timings)} requests, p50 {p50:.3f}s, "
+                f"p95 {p95:.3f}s, max {timings[-1]:.3f}s.")
 
 
-async def get_understat_players():
-    """Returns a list of dicts containing all information available on
-    https://understat.com/ for Premier League players.
+@metrics.timed("get_understat_histories")
+async def get_understat_histories(players_data):
+    """Returns the given Understat players with their match history (the
+    'understat_history' attribute) included.
     """
-    async with aiohttp.ClientSession() as session:
-        print("Getting players data...")
-        players_data = await understat_players_data(session)
+    semaphore = asyncio.Semaphore(UNDERSTAT_CONCURRENCY)
+    timings = []
+
+    async with create_session() as session:
         print("Getting matches data...")
-        tasks = [asyncio.ensure_future(understat_matches_data(session, player))
+        tasks = [asyncio.ensure_future(
+                    understat_matches_data(session, player, semaphore, timings))
                  for player in players_data]
         players = await asyncio.gather(*tasks)
 
+    log_request_timings("Understat player matches", timings)
     return players
 
 
-def create_text_indexes():
-    database.players.create_index([
-        ("web_name", "text"),
-        ("first_name", "text"),
-        ("second_name", "text")
-    ])
+def has_changed(player, stored_player, attributes):
+    """Returns True if any of the given attributes of the player differ from
+    the stored player's, or if the player hasn't been stored yet.
+    """
+    if not stored_player:
+        return True
 
+    return any(str(player.get(attribute)) != str(stored_player.get(attribute))
+               for attribute in attributes)
+
+
+@metrics.timed("match_understat_players")
+def match_understat_players(understat_players, fpl_players):
+    """Returns a list of (FPL player, Understat player) tuples, matched using
+    their names and teams, and a list of the Understat players that couldn't
+    be matched. When several Understat players match the same FPL player,
+    only the best match is kept and the others are unmatched.
+    """
+    players_by_name = defaultdict(list)
+    for player in fpl_players:
+        full_name = f"{player['first_name']} {player['second_name']}"
+        players_by_name[normalise_name(full_name)].append(player)
+        players_by_name[normalise_name(player["web_name"])].append(player)
+
+    players_by_id = {player["id"]: player for player in fpl_players}
+    name_index = PlayerNameIndex(fpl_players)
+
+    # (FPL player, score) of each Understat player, and the position of the
+    # best match of each FPL player
+    matches = []
+    best_matches = {}
+    for position, understat_player in enumerate(understat_players):
+        # Players who transferred mid-season have multiple teams, e.g.
+        # "Arsenal,Chelsea"
+        teams = {
+            normalise_name(understat_team_converter(team))
+            for team in understat_player["team_title"].split(",")
+        }
+        # Exact matches always beat fuzzy ones
+        candidates = [
+            (player, float("inf")) for player in players_by_name[
+                normalise_name(understat_player["player_name"])]
+        ]
+
+        # Fall back to fuzzy matching if the names differ, e.g. "Son Heung-Min"
+        if not any(normalise_name(player["team"]) in teams
+                   for player, _ in candidates):
+            candidates = [
+                (players_by_id[player_id], score)
+                for player_id, score in name_index.rank(
+                    understat_player["player_name"])[:10]
+            ]
+
+        relevant_player, score = next((
+            (player, score) for player, score in candidates
+            if normalise_name(player["team"]) in teams), (None, None))
+        matches.append((relevant_player, score))
+
+        if relevant_player:
+            best = best_matches.get(relevant_player["id"])
+            if best is None or score > matches[best][1]:
+                best_matches[relevant_player["id"]] = position
+
+    matched_players = []
+    unmatched_players = []
+    for position, understat_player in enumerate(understat_players):
+        relevant_player, _ = matches[position]
+        if relevant_player and best_matches[relevant_player["id"]] == position:
+            matched_players.append((relevant_player, understat_player))
+        else:
+            unmatched_players.append(understat_player)
+
+    return matched_players, unmatched_players
+
+
+@metrics.timed("update_fpl_players")
+async def update_fpl_players():
+    """Updates the FPL data of all players in the database, only fetching the
+    summaries of players who have played since the last update. Returns the
+    IDs of the players whose history or team has changed.
+    """
+    stored_players = await run_blocking(lambda: {
+        player["id"]: player
+        for player in database.players.find({}, {
+            "_id": 0, "id": 1, "team": 1,
+            **{attribute: 1 for attribute in fpl_change_attributes}
+        })
+    })
 
-async def update_players():
-    """Updates all players in the database."""
-    logger.info(f"Updating players")
     print("Getting FPL players...")
-    async with aiohttp.ClientSession() as session:
+    async with create_session() as session:
         fpl = FPL(session)
-        players = await fpl.get_players(include_summary=True, return_json=True)
-        for player in players:
-            player["team"] = team_converter(player["team"])
+        players = await fpl.get_players(return_json=True)
 
-    requests = [ReplaceOne({"id": player["id"]}, player, upsert=True)
+        changed_ids = [
+            player["id"] for player in players
+            if has_changed(player, stored_players.get(player["id"]),
+                           fpl_change_attributes)
+        ]
+        logger.info(f"{len(changed_ids)} FPL players have changed.")
+
+        # FPL.get_players() fetches every player when given no IDs
+        if changed_ids:
+            summaries = await fpl.get_players(
+                changed_ids, include_summary=True, return_json=True)
+            summaries = {player["id"]: player for player in summaries}
+            players = [summaries.get(player["id"], player)
+                       for player in players]
+
+    changed_ids = set(changed_ids)
+    history_requests = []
+    for player in players:
+        player["team"] = team_converter(player["team"])
+        stored_player = stored_players.get(player["id"])
+        if stored_player and stored_player.get("team") != player["team"]:
+            changed_ids.add(player["id"])
+        # The history is stored per fixture, and the rest of the summary
+        # isn't used.
+        history = player.pop("history", None)
+        player.pop("fixtures", None)
+        player.pop("history_past", None)
+        if history is not None:
+            history_requests += fpl_history_requests(player["id"], history)
+            # FPL reuses the IDs of players and fixtures every season, so
+            # fixtures that are no longer in the history are removed.
+            history_requests.append(DeleteMany({
+                "player_id": player["id"],
+                "fixture": {"$nin": [fixture["fixture"]
+                                     for fixture in history]}
+            }))
+
+    if history_requests:
+        await run_blocking(database.fpl_history.bulk_write, history_requests,
+                           ordered=False)
+
+    requests = [UpdateOne({"id": player["id"]}, {"$set": player}, upsert=True)
                 for player in players]
-    database.players.bulk_write(requests)
-    create_text_indexes()
+    await run_blocking(database.players.bulk_write, requests)
+    return changed_ids
+
 
+@metrics.timed("update_understat_players")
+async def update_understat_players():
+    """Updates the Understat data of all players in the database, only
+    fetching the match history of players who have played since the last
+    update. Returns the IDs of the players whose matches were updated.
+    """
     print("Getting Understat players...")
-    understat_players = await get_understat_players()
+    async with create_session() as session:
+        understat_players = await understat_players_data(session)
     print("Retrieved Understat players...")
 
-    for player in understat_players:
+    fpl_players = await run_blocking(lambda: list(database.players.find({}, {
+        "_id": 0, "id": 1, "web_name": 1, "first_name": 1, "second_name": 1,
+        "team": 1, "selected_by_percent": 1,
+        **{attribute: 1 for attribute in understat_change_attributes}
+    })))
+    matched_players, unmatched_players = await run_blocking(
+        match_understat_players, understat_players, fpl_players)
+
+    for player in unmatched_players:
+        logger.info(f"Understat player {player['player_name']} "
+                    f"({player['team_title']}) could not be matched.")
+
+    changed_players = [
+        (relevant_player["id"], player)
+        for relevant_player, player in matched_players
+        if has_changed(player, relevant_player, understat_change_attributes)
+    ]
+
+    logger.info(f"{len(changed_players)} Understat players have changed.")
+    await get_understat_histories([player for _, player in changed_players])
+
+    requests = []
+    match_requests = []
+    updated_ids = set()
+    for player_id, player in changed_players:
+        # Don't store the new counters if the match history couldn't be
+        # fetched, so it is fetched again next time.
+        if "understat_history" not in player:
+            continue
+
         # Only update FPL player with desired attributes
         understat_attributes = {
             attribute: value for attribute, value in player.items()
             if attribute in desired_attributes
         }
-
-        # Use player's full name and team to try and find the correct player
-        search_string = f"{player['player_name']} {player['team_title']}"
-        players = database.players.find(
-            {"$text": {"$search": search_string}},
-            {"score": {"$meta": "textScore"}}
-        ).sort([("score", {"$meta": "textScore"})])
-        try:
-            relevant_player = list(players)[0]
-        except IndexError:
-            continue
-
-        database.players.update_one(
-            {"id": relevant_player["id"]},
-            {"$set": understat_attributes}
-        )
-
-
+        requests.append(
+            UpdateOne({"id": player_id}, {"$set": understat_attributes}))
+        updated_ids.add(player_id)
+        match_requests += understat_match_requests(
+            player_id, player["understat_history"])
+        # The FPL player could have been matched to a different Understat
+        # player (e.g. when FPL reuses their ID), so other matches are removed.
+        match_requests.append(DeleteMany({
+            "player_id": player_id,
+            "id": {"$nin": [match["id"]
+                            for match in player["understat_history"]]}
+        }))
+
+    # The matches are stored first, so the counters aren't updated if that
+    # fails.
+    if match_requests:
+        await run_blocking(database.understat_matches.bulk_write,
+                           match_requests, ordered=False)
+    if requests:
+        await run_blocking(database.players.bulk_write, requests)
+    return updated_ids
+
+
+@metrics.timed("update_players")
+async def update_players():
+    """Updates all players in the database. The data is fetched
+    asynchronously, and the database is used (and the aggregates are built)
+    in other threads, so the event loop isn't blocked.
+    """
+    logger.info(f"Updating players")
+    await run_blocking(create_indexes)
+    changed_ids = await update_fpl_players()
+    changed_ids |= await update_understat_players()
+    # Only the aggregates of players whose fixtures have changed are rebuilt
+    # (and those that are missing or outdated).
+    changed_ids |= await run_blocking(get_outdated_player_ids)
+    await run_blocking(materialize_aggregates, changed_ids)
+    await run_blocking(bump_data_version, "players")
+    logger.info(f"Ingestion metrics: {json.dumps(metrics.to_json())}")
+
+
+@metrics.timed("update_results")
 async def update_results():
-    async with aiohttp.ClientSession() as session:
+    async with create_session() as session:
         understat = Understat(session)
         results = await understat.get_league_results("EPL", "2021")
         for result in results:
             result["h"]["title"] = understat_team_converter(result["h"]["title"])
             result["a"]["title"] = understat_team_converter(result["a"]["title"])
 
+    old_results = await run_blocking(load_results_index)
+    changed_ids = [result["id"] for result in results
+                   if old_results.get(result["id"]) != index_result(result)]
+
     requests = [ReplaceOne({"id": result["id"]}, result, upsert=True)
                 for result in results]
-    database.results.bulk_write(requests)
+    await run_blocking(database.results.bulk_write, requests)
+    # Only this season's aggregates depend on the results, and only those of
+    # players who played in a new (or revised) result need to be rebuilt.
+    player_ids = await run_blocking(get_match_player_ids, changed_ids)
+    await run_blocking(materialize_season_aggregates, player_ids)
+    await run_blocking(bump_data_version, "results")
 
 
-def get_xGA(fixture_id, player_team):
-    database_fixture = database.results.find_one({"id": fixture_id})
-    if database_fixture["h"]["title"] == player_team:
-        xGA = float(database_fixture["xG"]["a"])
-    else:
-        xGA = float(database_fixture["xG"]["h"])
-    return xGA
+def fpl_history_requests(player_id, history):
+    """Returns the requests storing each fixture of the player's FPL history
+    in the fpl_history collection.
+    """
+    return [ReplaceOne({"player_id": player_id, "fixture": fixture["fixture"]},
+                       {**fixture, "player_id": player_id}, upsert=True)
+            for fixture in history]
 
 
-def create_goalkeeper_table(player, history_list, fixtures):
-    """Returns a Markdown table for a goalkeeper."""
+def create_understat_match(player_id, match):
+    """Returns the Understat match as stored in the understat_matches
+    collection, with its values parsed and the FPL names of both teams in
+    "teams".
+    """
+    document = {
+        "player_id": player_id,
+        "h_team": match["h_team"],
+        "a_team": match["a_team"],
+        "teams": [to_fpl_team(match["h_team"].lower()),
+                  to_fpl_team(match["a_team"].lower())]
+    }
+    for column in understat_int_columns:
+        document[column] = int(match[column])
+    for column in understat_float_columns:
+        document[column] = float(match[column])
+    for column in understat_str_columns:
+        document[column] = match[column]
+    return document
+
+
+def understat_match_requests(player_id, matches):
+    """Returns the requests storing each of the player's Understat matches in
+    the understat_matches collection.
+    """
+    return [ReplaceOne({"player_id": player_id, "id": match["id"]},
+                       create_understat_match(player_id, match), upsert=True)
+            for match in matches]
+
+
+def create_season_aggregates(player_team, matches, results):
+    """Returns the aggregates (see aggregates.py) of the player's Understat
+    matches (most recent first) of this season, in total and by venue.
+    """
+    season_matches = []
+    for match in matches:
+        if match["id"] not in results:
+            continue
+        home_team, home_xG, away_xG = results[match["id"]]
+        is_home = home_team == player_team
+        # The player tables sum the values as shown, rounded to two decimals
+        season_matches.append({
+            **match,
+            **{column: round(match[column], 2)
+               for column in understat_float_columns},
+            "is_home": is_home,
+            "xGA": round(away_xG if is_home else home_xG, 2)
+        })
+
+    def match_group(rows):
+        return create_group([row["id"] for row in rows], rows,
+                            understat_total_columns + ["xGA"])
+
+    return {
+        "all": match_group(season_matches),
+        "h": match_group([match for match in season_matches
+                          if match["is_home"]]),
+        "a": match_group([match for match in season_matches
+                          if not match["is_home"]])
+    }
+
+
+def create_player_aggregates(player_id, player_team, matches, history,
+                             results):
+    """Returns the aggregates (see aggregates.py) of the player's Understat
+    matches and FPL history, both most recent first, that they played in.
+    These are grouped into this season's matches and fixtures (in total and
+    by venue), and the matches against each team as used by
+    get_relevant_matches.
+    """
+    def history_group(rows):
+        return create_group([row["fixture"] for row in rows], rows,
+                            fpl_total_columns)
+
+    matches_by_team = defaultdict(list)
+    for match in matches:
+        if not any(team in fpl_team_names for team in match["teams"]):
+            continue
+        for team in set(match["teams"]):
+            matches_by_team[team].append(match)
+
+    opponents = []
+    for team, team_matches in matches_by_team.items():
+        # Only matches for the player's current team, like
+        # get_relevant_matches.
+        if len(team_matches) > 10:
+            team_matches = [match for match in team_matches
+                            if player_team.lower() in match["teams"]]
+        opponents.append({
+            "team": team,
+            **create_group([match["id"] for match in team_matches],
+                           team_matches, understat_total_columns)
+        })
+
+    return {
+        "player_id": player_id,
+        "version": AGGREGATES_VERSION,
+        "season": create_season_aggregates(player_team, matches, results),
+        "fpl": {
+            "all": history_group(history),
+            "h": history_group([fixture for fixture in history
+                                if fixture["was_home"]]),
+            "a": history_group([fixture for fixture in history
+                                if not fixture["was_home"]])
+        },
+        "opponents": opponents
+    }
+
+
+def group_by_player(rows):
+    """Returns a dict mapping the ID of each player to their rows, which must
+    be sorted by player.
+    """
+    return {player_id: list(player_rows) for player_id, player_rows in
+            groupby(rows, key=itemgetter("player_id"))}
+
+
+@metrics.timed("create_aggregates")
+def create_aggregates(player_ids=None):
+    """Returns the aggregates of the given players, or of all players."""
+    results = load_results_index()
+    history_by_player = group_by_player(get_all_fpl_history(player_ids))
+    matches_by_player = group_by_player(get_all_understat_matches(player_ids))
+
+    return [
+        create_player_aggregates(
+            player_id, player_team, matches_by_player.get(player_id, []),
+            history_by_player.get(player_id, []), results)
+        for player_id, player_team in get_player_teams(player_ids).items()
+    ]
 
-    table_body = []
-    total_result = []
 
-    table_header = ["Fixture", "MP", "GA", "xGA", "Saves", "Points"]
-    alignment = ("left", "right", "right", "right", "right", "right")
+def materialize_aggregates(player_ids=None):
+    """Stores the aggregates of the given players (or of all players), after
+    their fixtures have been updated.
+    """
+    if player_ids is not None and not player_ids:
+        return
 
-    total_points = 0
-    total_bonus = 0
+    requests = [ReplaceOne({"player_id": aggregates["player_id"]},
+                           aggregates, upsert=True)
+                for aggregates in create_aggregates(player_ids)]
+    if requests:
+        database.player_aggregates.bulk_write(requests, ordered=False)
 
-    for history, fixture in zip(history_list, fixtures[::-1]):
-        result = (f"{fixture['h_team']} {fixture['h_goals']}-"
-                  f"{fixture['a_goals']} {fixture['a_team']}")
-        points = f"{history['total_points']} ({history['bonus']})"
-        xGA = get_xGA(fixture["id"], player["team"])
 
-        table_row = [
-            result, int(fixture["time"]),  history["goals_conceded"],
-            f"{xGA:.2f}", history['saves'], points
-        ]
+def materialize_season_aggregates(player_ids):
+    """Updates the aggregates of this season's matches of the given players,
+    after the results have been updated. Players without (up to date)
+    aggregates are skipped, since they are rebuilt with the players.
+    """
+    if not player_ids:
+        return
+
+    results = load_results_index()
+    matches_by_player = group_by_player(get_all_understat_matches(player_ids))
+    requests = [
+        UpdateOne({"player_id": player_id, "version": AGGREGATES_VERSION},
+                  {"$set": {"season": create_season_aggregates(
+                      player_team, matches_by_player.get(player_id, []),
+                      results)}})
+        for player_id, player_team in get_player_teams(player_ids).items()
+    ]
+    database.player_aggregates.bulk_write(requests, ordered=False)
 
-        table_body.append(table_row)
-        total_result.append(table_row[1:-1])
-        total_points += history["total_points"]
-        total_bonus += history["bonus"]
 
-    # List comprehension to sum the values of each of the table's columns
-    table_footer = [sum([float(j) if isinstance(j, str) else j for j in i])
-                    for i in zip(*total_result)]
+def get_outdated_player_ids():
+    """Returns the IDs of the players whose aggregates are missing, or are of
+    an older version.
+    """
+    return (set(get_player_teams()) -
+            get_aggregated_player_ids(AGGREGATES_VERSION))
 
-    # Bold the values in the table's footer
-    for i, value in enumerate(table_footer):
-        if isinstance(value, float):
-            value = f"{value:.2f}"
 
-        table_footer[i] = f"**{value}**"
+def create_understat_columns(matches):
+    """Returns the given Understat matches as columns of parsed values, with
+    the teams stored as indices into the "teams" column.
+    """
+    columns = {column: [] for column in (
+        understat_int_columns + understat_float_columns +
+        understat_str_columns + ["h_team", "a_team"])}
+    columns["teams"] = []
+    team_ids = {}
+
+    for match in matches:
+        for team_column in ("h_team", "a_team"):
+            team = match[team_column]
+            if team not in team_ids:
+                team_ids[team] = len(columns["teams"])
+                columns["teams"].append(team)
+            columns[team_column].append(team_ids[team])
+
+        for column in understat_int_columns:
+            columns[column].append(int(match[column]))
+        for column in understat_float_columns:
+            columns[column].append(float(match[column]))
+        for column in understat_str_columns:
+            columns[column].append(match[column])
+
+    return columns
+
+
+def format_result(columns, row):
+    """Returns the result of the fixture in the given row, e.g.
+    "Spurs 3-1 Leicester".
+    """
+    teams = columns["teams"]
+    return (f"{teams[columns['h_team'][row]]} {columns['h_goals'][row]}-"
+            f"{columns['a_goals'][row]} {teams[columns['a_team'][row]]}")
 
-    table_body.append([""] + table_footer + [f"**{total_points} ({total_bonus})**"])
-    table = tabulate(table_body, headers=table_header, tablefmt="pipe",
-                     colalign=alignment)
 
-    return f"# {player['web_name']}\n\n{table}"
+@metrics.timed("get_xGA")
+def get_xGA(fixture_ids, player_team):
+    """Returns a list containing the xGA of the player's team in each of the
+    given fixtures.
+    """
+    results = get_results_index()
+    xGA = []
+    for fixture_id in fixture_ids:
+        home_team, home_xG, away_xG = results[fixture_id]
+        xGA.append(away_xG if home_team == player_team else home_xG)
+    return xGA
 
 
-def get_player_table(players, risers=True):
-    """Returns the table used in the player price change posts on Reddit."""
-    table_header = ("|Name|Team|Position|Ownership|Price|∆|Form|\n"
-                    "|:-|:-|:-|:-:|:-:|:-:|:-:|\n")
-
-    table_body = "\n".join([
-            f"|{player.web_name}|"
-            f"{team_converter(player.team)}|"
-            f"{position_converter(player.element_type)}|"
-            f"{player.selected_by_percent}%|"
-            f"£{player.now_cost / 10.0:.1f}|"
-            f"{'+' if risers else '-'}£{abs(player.cost_change_event / 10.0):.1f}|"
-            f"{sum([fixture['total_points'] for fixture in player.history[-5:]])}|"
-            for player in players])
-
-    return table_header + table_body
-
-
-def get_total(total, fixture):
-    for key, value in fixture.items():
-        total.setdefault(key, 0)
-        try:
-            total[key] += float(value)
-        except ValueError:
-            continue
-    return total
+def points_column(totals=None):
+    """Returns the column showing a player's points (and bonus points) in
+    rows of (history, row, xGA) tuples.
+    """
+    def total(rows):
+        total_points = sum(history["total_points"] for history, _, _ in rows)
+        total_bonus = sum(history["bonus"] for history, _, _ in rows)
+        return f"{total_points} ({total_bonus})"
 
+    if totals is not None:
+        total = fixed_total(f"{totals['total_points']} ({totals['bonus']})")
 
-def create_player_table(player, history_list, fixtures):
-    """Returns a Markdown table for players who aren't goalkeepers."""
+    return Column(
+        "Points",
+        lambda row: f"{row[0]['total_points']} ({row[0]['bonus']})",
+        total=total)
 
-    table_body = []
-    total_result = []
 
-    table_header = ["Fixture", "MP", "G", "xG", "A", "xA", "Points"]
-    alignment = ("left", "right", "right", "right", "right", "right", "right")
+def history_column(header, key, totals=None):
+    """Returns a column showing the given attribute of a player's FPL history
+    in rows of (history, row, xGA) tuples. Its total is taken from `totals`
+    if given, and otherwise summed.
+    """
+    if totals is not None:
+        total = fixed_total(totals[key])
+    else:
+        total = sum_column(lambda row: row[0][key])
+    return Column(header, lambda row: str(row[0][key]), total=total)
 
-    # If the player is a defender, also include GA and xGA
-    if player["element_type"] == 2:
-        table_header.insert(-1, "GA")
-        table_header.insert(-1, "xGA")
-        alignment = (*alignment, "right", "right")
-
-    total_points = 0
-    total_bonus = 0
-
-    for history, fixture in zip(history_list, fixtures[::-1]):
-        result = (f"{fixture['h_team']} {fixture['h_goals']}-"
-                  f"{fixture['a_goals']} {fixture['a_team']}")
-        points = f"{history['total_points']} ({history['bonus']})"
-
-        table_row = [
-            result, int(fixture["time"]), history["goals_scored"],
-            f"{float(fixture['xG']):.2f}", history["assists"],
-            f"{float(fixture['xA']):.2f}", points
-        ]
 
-        # Player is a defender, so add additional data
-        if player["element_type"] == 2:
-            xGA = get_xGA(fixture["id"], player["team"])
-            table_row.insert(-1, history["goals_conceded"])
-            table_row.insert(-1, float(f"{xGA:.2f}"))
+def understat_column(header, columns, key, float_format=None, totals=None):
+    """Returns a column showing the given column of a player's Understat match
+    history in rows of (history, row, xGA) tuples. Its total is taken from
+    `totals` if given, and otherwise summed.
+    """
+    values = columns[key]
+    if float_format:
+        cell = lambda row: f"{values[row[1]]:{float_format}}"
+    else:
+        cell = lambda row: str(values[row[1]])
+
+    if totals is not None:
+        total = fixed_total(totals[key], float_format)
+    elif float_format:
+        # The total is the sum of the rounded values shown in the column
+        total = sum_column(lambda row: round(values[row[1]], 2), float_format)
+    else:
+        total = sum_column(lambda row: values[row[1]])
+    return Column(header, cell, total=total)
+
+
+def xGA_column(totals=None, float_format=".2f"):
+    """Returns the column showing the xGA of a player's team in rows of
+    (history, row, xGA) tuples. If `float_format` is None, the xGA is shown
+    rounded to two decimals without trailing zeros (e.g. 1.3).
+    """
+    if float_format:
+        cell = lambda row: f"{row[2]:{float_format}}"
+    else:
+        cell = lambda row: str(round(row[2], 2))
+
+    if totals is not None:
+        total = fixed_total(totals["xGA"], ".2f")
+    else:
+        # The total is the sum of the rounded values shown in the column
+        total = sum_column(lambda row: round(row[2], 2), ".2f")
+    return Column("xGA", cell, total=total)
 
-        table_body.append(table_row)
-        total_result.append(table_row[1:-1])
-        total_points += history["total_points"]
-        total_bonus += history["bonus"]
 
-    # List comprehension to sum the values of each of the table's columns
-    table_footer = [sum([float(j) if isinstance(j, str) else j for j in i])
-                    for i in zip(*total_result)]
+def get_table_rows(player, history_list, columns, rows, include_xGA):
+    """Returns a list of (history, row, xGA) tuples, pairing each fixture in
+    the player's FPL history with the same fixture in their Understat match
+    history (and their team's xGA in it).
+    """
+    rows = rows[::-1][:len(history_list)]
+    if include_xGA:
+        xGA_list = get_xGA([columns["id"][row] for row in rows],
+                           player["team"])
+    else:
+        xGA_list = [None] * len(rows)
 
-    # Bold the values in the table's footer
-    for i, value in enumerate(table_footer):
-        if isinstance(value, float):
-            value = f"{value:.2f}"
+    return list(zip(history_list, rows, xGA_list))
 
-        table_footer[i] = f"**{value}**"
 
-    table_body.append([""] + table_footer + [f"**{total_points} ({total_bonus})**"])
-    table = tabulate(table_body, headers=table_header, tablefmt="pipe",
-                     colalign=alignment)
+def create_goalkeeper_table(player, history_list, columns, rows,
+                            history_totals=None, match_totals=None):
+    """Returns a Markdown table for a goalkeeper."""
+    table_rows = get_table_rows(player, history_list, columns, rows, True)
+    table_columns = [
+        Column("Fixture", lambda row: format_result(columns, row[1]),
+               align="left"),
+        understat_column("MP", columns, "time", totals=match_totals),
+        history_column("GA", "goals_conceded", history_totals),
+        xGA_column(match_totals),
+        history_column("Saves", "saves", history_totals),
+        points_column(history_totals)
+    ]
 
+    table = render_table(table_columns, table_rows)
+    return f"# {player['web_name']}\n\n{table}"
+
+
+def get_player_table(players, risers=True):
+    """Returns the table used in the player price change posts on Reddit."""
+    table_columns = [
+        Column("Name", lambda player: player.web_name, align="left"),
+        Column("Team", lambda player: team_converter(player.team),
+               align="left"),
+        Column("Position",
+               lambda player: position_converter(player.element_type),
+               align="left"),
+        Column("Ownership", lambda player: f"{player.selected_by_percent}%",
+               align="center"),
+        Column("Price", lambda player: f"£{player.now_cost / 10.0:.1f}",
+               align="center"),
+        Column("∆", lambda player: (
+                   f"{'+' if risers else '-'}"
+                   f"£{abs(player.cost_change_event / 10.0):.1f}"),
+               align="center"),
+        Column("Form", lambda player: str(sum(
+                   [fixture["total_points"]
+                    for fixture in player.history[-5:]])),
+               align="center")
+    ]
+
+    return render_table(table_columns, players)
+
+
+def create_player_table(player, history_list, columns, rows,
+                        history_totals=None, match_totals=None):
+    """Returns a Markdown table for players who aren't goalkeepers."""
+    is_defender = player["element_type"] == 2
+    table_rows = get_table_rows(
+        player, history_list, columns, rows, is_defender)
+    table_columns = [
+        Column("Fixture", lambda row: format_result(columns, row[1]),
+               align="left"),
+        understat_column("MP", columns, "time", totals=match_totals),
+        history_column("G", "goals_scored", history_totals),
+        understat_column("xG", columns, "xG", ".2f", match_totals),
+        history_column("A", "assists", history_totals),
+        understat_column("xA", columns, "xA", ".2f", match_totals)
+    ]
+
+    # If the player is a defender, also include GA and xGA
+    if is_defender:
+        table_columns += [
+            history_column("GA", "goals_conceded", history_totals),
+            xGA_column(match_totals, float_format=None)
+        ]
+
+    table_columns.append(points_column(history_totals))
+    table = render_table(table_columns, table_rows)
     return f"# {player['web_name']}\n\n{table}"
 
 
@@ -313,93 +942,110 @@ def player_vs_player_table(players, number_of_fixtures):
     tables = []
 
     for player in players:
-        fixtures = get_relevant_fixtures(player)[:number_of_fixtures]
-        history = get_relevant_history(player["history"])[-number_of_fixtures:]
+        matches = get_relevant_matches(player, limit=number_of_fixtures)
+        columns = create_understat_columns(matches)
+        rows = list(range(len(matches)))
+        history = get_fpl_history(player["id"], number_of_fixtures)
+        history_totals, match_totals = get_table_totals(
+            player["id"], history, matches)
 
         # Player is a goalkeeper
         if player["element_type"] == 1:
-            table = create_goalkeeper_table(player, history, fixtures)
+            table = create_goalkeeper_table(player, history, columns, rows,
+                                            history_totals, match_totals)
         else:
-            table = create_player_table(player, history, fixtures)
+            table = create_player_table(player, history, columns, rows,
+                                        history_totals, match_totals)
 
         tables.append(table)
 
     return tables[0] + "\n\n" + tables[1]
 
 
-def player_vs_team_table(fixtures):
+def player_vs_team_table(columns, rows, totals=None):
     """Returns a Markdown table showing the player's performance in the
-    given fixtures.
+    fixtures in the given rows of their match history. The totals are taken
+    from `totals` if given, and otherwise summed.
     """
-    table = ("|Fixture|Date|MP|G|xG|A|xA|NPG|NPxG|KP|\n"
-             "|:-|:-|-:|-:|-:|-:|-:|-:|-:|-:|\n")
-
-    total = {}
+    teams = columns["teams"]
+    home_teams = columns["h_team"]
+    away_teams = columns["a_team"]
+    home_goals = columns["h_goals"]
+    away_goals = columns["a_goals"]
 
-    for fixture in fixtures:
-        home_team = f"{fixture['h_team']} {fixture['h_goals']}"
-        away_team = f"{fixture['a_goals']} {fixture['a_team']}"
-        minutes_played = fixture["time"]
+    def fixture_cell(row):
+        home_team = f"{teams[home_teams[row]]} {home_goals[row]}"
+        away_team = f"{away_goals[row]} {teams[away_teams[row]]}"
 
         # Highlight the winning team
-        if int(fixture["h_goals"]) > int(fixture["a_goals"]):
-            home_team = f"**{fixture['h_team']}** {fixture['h_goals']}"
-        elif int(fixture["h_goals"]) < int(fixture["a_goals"]):
-            away_team = f"**{fixture['a_goals']}** {fixture['a_team']}"
+        if home_goals[row] > away_goals[row]:
+            home_team = f"**{teams[home_teams[row]]}** {home_goals[row]}"
+        elif home_goals[row] < away_goals[row]:
+            away_team = f"**{away_goals[row]}** {teams[away_teams[row]]}"
 
-        # Highlight whether the player was a starter or not
-        if fixture["position"].lower() != "sub":
-            minutes_played = f"**{minutes_played}**"
-
-        table += (
-            f"|{home_team}-{away_team}"
-            f"|{fixture['date']}"
-            f"|{minutes_played}"
-            f"|{fixture['goals']}"
-            f"|{float(fixture['xG']):.2f}"
-            f"|{fixture['assists']}"
-            f"|{float(fixture['xA']):.2f}"
-            f"|{fixture['npg']}"
-            f"|{float(fixture['npxG']):.2f}"
-            f"|{fixture['key_passes']}|\n"
-        )
-
-        for key, value in fixture.items():
-            total.setdefault(key, 0)
-            try:
-                total[key] += float(value)
-            except ValueError:
-                continue
-
-    # Add footer with totals
-    table_footer = (
-        f"|||**{int(total['time'])}**"
-        f"|**{int(total['goals'])}**"
-        f"|**{total['xG']:.2f}**"
-        f"|**{int(total['assists'])}**"
-        f"|**{total['xA']:.2f}**"
-        f"|**{total['npg']}**"
-        f"|**{total['npxG']:.2f}**"
-        f"|**{int(total['key_passes'])}**|\n"
-    )
+        return f"{home_team}-{away_team}"
 
-    return table + table_footer
+    def minutes_cell(row):
+        # Highlight whether the player was a starter or not
+        if columns["position"][row].lower() != "sub":
+            return f"**{columns['time'][row]}**"
+        return str(columns["time"][row])
+
+    def match_total(key, float_format=None, total_type=None):
+        if totals is not None:
+            total = totals[key]
+            return fixed_total(total_type(total) if total_type else total,
+                               float_format)
+        values = columns[key]
+        if total_type:
+            return sum_column(lambda row: total_type(values[row]),
+                              float_format)
+        return sum_column(lambda row: values[row], float_format)
+
+    def match_column(header, key, float_format=None, total_type=None):
+        values = columns[key]
+        if float_format:
+            cell = lambda row: f"{values[row]:{float_format}}"
+        else:
+            cell = lambda row: str(values[row])
+        return Column(header, cell,
+                      total=match_total(key, float_format, total_type))
+
+    table_columns = [
+        Column("Fixture", fixture_cell, align="left"),
+        Column("Date", lambda row: columns["date"][row], align="left"),
+        Column("MP", minutes_cell, total=match_total("time")),
+        match_column("G", "goals"),
+        match_column("xG", "xG", ".2f"),
+        match_column("A", "assists"),
+        match_column("xA", "xA", ".2f"),
+        # The total of the non-penalty goals is shown as a float, e.g. 1.0
+        match_column("NPG", "npg", total_type=float),
+        match_column("NPxG", "npxG", ".2f"),
+        match_column("KP", "key_passes")
+    ]
 
+    return render_table(table_columns, rows) + "\n"
 
-def find_player(player_name):
-    # Find most relevant player using text search
-    players = database.players.find(
-        {"$text": {"$search": player_name}},
-        {"score": {"$meta": "textScore"}}
-    ).sort([("score", {"$meta": "textScore"})])
 
-    try:
-        player = list(players.limit(1))[0]
-    except IndexError:
+@metrics.timed("find_player")
+def find_player_id(player_name):
+    """Returns the ID of the player whose name best matches the given name."""
+    player_ids = get_player_index().search(player_name, limit=1)
+    if not player_ids:
         logger.error(f"Player {player_name} could not be found!")
         return None
 
-    return player
+    return player_ids[0]
+
+
+def find_player(player_name):
+    # Find most relevant player using the index of player names
+    player_id = find_player_id(player_name)
+    if player_id is None:
+        return None
+
+    return get_table_player(player_id)
 
 
 def to_fpl_team(team_name):
@@ -423,45 +1069,66 @@ def understat_team_converter(team_name):
         return team_name
 
 
-def get_relevant_history(history):
-    return [fixture for fixture in history if fixture["minutes"] > 0]
+def get_table_totals(player_id, history, matches):
+    """Returns the totals of the player's FPL history and Understat matches
+    shown in their table (see get_table_rows), taken from their aggregates.
+    Returns (None, None) if the aggregates are missing or outdated, in which
+    case the rows are summed instead.
+    """
+    aggregates = get_player_aggregates(player_id, ["season.all", "fpl.all"])
+    if not aggregates or aggregates.get("version") != AGGREGATES_VERSION:
+        return None, None
+
+    season_group = aggregates["season"]["all"]
+    fpl_group = aggregates["fpl"]["all"]
+    # The aggregates are most recent first, like the matches
+    if (not covers(season_group, [match["id"] for match in matches]) or
+            not covers(fpl_group, [fixture["fixture"]
+                                   for fixture in reversed(history)])):
+        return None, None
+
+    # If there are fewer fixtures than matches (or vice versa), only the
+    # oldest ones of the other are shown.
+    number_of_rows = min(len(history), len(matches))
+    return (window_totals(fpl_group, len(history) - number_of_rows,
+                          len(history)),
+            window_totals(season_group, len(matches) - number_of_rows,
+                          len(matches)))
+
+
+def get_opponent_totals(player_id, team_name, matches):
+    """Returns the totals of the player's Understat matches against the given
+    team (see get_relevant_matches), taken from their aggregates, or None if
+    they are missing or outdated.
+    """
+    team_name = to_fpl_team(team_name.lower()).lower()
+    group = get_opponent_aggregates(player_id, team_name, AGGREGATES_VERSION)
+    if not group or not covers(group, [match["id"] for match in matches]):
+        return None
+    return window_totals(group, 0, len(matches))
 
 
-def get_relevant_fixtures(player, team_name=None):
-    """Return all fixtures that the player has played for his current team
-    (optionally) against the given team.
+@metrics.timed("get_relevant_matches")
+def get_relevant_matches(player, team_name=None, limit=0):
+    """Returns the Understat matches (most recent first) that the player has
+    played for his current team (optionally) against the given team.
     """
-    fixtures = [
-        fixture for fixture in player["understat_history"]
-        if (to_fpl_team(fixture["h_team"].lower()) in fpl_team_names or
-            to_fpl_team(fixture["a_team"].lower()) in fpl_team_names) and
-        int(fixture["time"]) > 0
-    ]
+    if not team_name:
+        # If comparing player vs. player, then only include this season.
+        return get_understat_matches(
+            player["id"], fixture_ids=get_result_ids(), limit=limit)
 
-    if team_name:
-        team_name = to_fpl_team(team_name.lower()).lower()
-        fixtures = [
-            fixture for fixture in fixtures
-            if team_name == to_fpl_team(fixture["h_team"].lower()) or
-            team_name == to_fpl_team(fixture["a_team"].lower())
-        ]
+    team_name = to_fpl_team(team_name.lower()).lower()
+    matches = get_understat_matches(player["id"], team=team_name)
 
-        # Player could've played for the given team before, so only include
-        # fixtures played vs. them for his current team.
-        if len(fixtures) > 10:
-            fixtures = [
-                fixture for fixture in fixtures
-                if player["team"].lower() in [
-                        to_fpl_team(fixture["h_team"].lower()),
-                        to_fpl_team(fixture["a_team"].lower())
-                    ]
-                ]
-    else:
-        # If comparing player vs. player, then only include this season.
-        fixture_ids = [result["id"] for result in database.results.find()]
-        fixtures = [f for f in fixtures if f["id"] in fixture_ids]
+    # Player could've played for the given team before, so only include
+    # fixtures played vs. them for his current team.
+    if len(matches) > 10:
+        player_team = player["team"].lower()
+        matches = [match for match in matches
+                   if player_team in match["teams"]]
 
-    return fixtures
+    return matches[:limit] if limit else matches
 
 
 if __name__ == "__main__":
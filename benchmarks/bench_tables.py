@@ -0,0 +1,115 @@
+"""Microbenchmark comparing FPLbot's Markdown table renderer with tabulate.
+
+    python benchmarks/bench_tables.py
+"""
+import os
+import random
+import sys
+import timeit
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "FPLbot"))
+
+from tables import Column, render_table, sum_column  # noqa: E402
+
+NUMBER = 2000
+
+
+def create_rows(number_of_rows=10):
+    """Returns rows similar to the ones in a defender's table."""
+    random.seed(0)
+    return [{
+        "fixture": "Liverpool 2-1 Man Utd",
+        "time": random.randint(1, 90),
+        "goals": random.randint(0, 2),
+        "xG": random.random(),
+        "assists": random.randint(0, 2),
+        "xA": random.random(),
+        "goals_conceded": random.randint(0, 3),
+        "xGA": random.random() * 2,
+        "total_points": random.randint(0, 15),
+        "bonus": random.randint(0, 3)
+    } for _ in range(number_of_rows)]
+
+
+def render_with_tabulate(rows):
+    """Renders the table the way the table builders used to."""
+    table_header = ["Fixture", "MP", "G", "xG", "A", "xA", "GA", "xGA",
+                    "Points"]
+    alignment = ("left", "right", "right", "right", "right", "right", "right",
+                 "right", "right")
+
+    table_body = []
+    total_result = []
+    for row in rows:
+        table_row = [
+            row["fixture"], row["time"], row["goals"], f"{row['xG']:.2f}",
+            row["assists"], f"{row['xA']:.2f}", row["goals_conceded"],
+            float(f"{row['xGA']:.2f}"),
+            f"{row['total_points']} ({row['bonus']})"
+        ]
+        table_body.append(table_row)
+        total_result.append(table_row[1:-1])
+
+    table_footer = [sum([float(j) if isinstance(j, str) else j for j in i])
+                    for i in zip(*total_result)]
+    for i, value in enumerate(table_footer):
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        table_footer[i] = f"**{value}**"
+
+    total_points = sum(row["total_points"] for row in rows)
+    total_bonus = sum(row["bonus"] for row in rows)
+    table_body.append([""] + table_footer +
+                      [f"**{total_points} ({total_bonus})**"])
+    return tabulate(table_body, headers=table_header, tablefmt="pipe",
+                    colalign=alignment)
+
+
+def render_with_columns(rows):
+    def column(header, key, float_format=None):
+        if float_format:
+            cell = lambda row: f"{row[key]:{float_format}}"
+        else:
+            cell = lambda row: str(row[key])
+        return Column(header, cell,
+                      total=sum_column(lambda row: row[key], float_format))
+
+    def points_total(rows):
+        total_points = sum(row["total_points"] for row in rows)
+        total_bonus = sum(row["bonus"] for row in rows)
+        return f"{total_points} ({total_bonus})"
+
+    table_columns = [
+        Column("Fixture", lambda row: row["fixture"], align="left"),
+        column("MP", "time"),
+        column("G", "goals"),
+        column("xG", "xG", ".2f"),
+        column("A", "assists"),
+        column("xA", "xA", ".2f"),
+        column("GA", "goals_conceded"),
+        column("xGA", "xGA", ".2f"),
+        Column("Points",
+               lambda row: f"{row['total_points']} ({row['bonus']})",
+               total=points_total)
+    ]
+    return render_table(table_columns, rows)
+
+
+def main():
+    rows = create_rows()
+    results = {}
+    for name, render in (("tabulate", render_with_tabulate),
+                         ("render_table", render_with_columns)):
+        seconds = min(timeit.repeat(lambda: render(rows), number=NUMBER,
+                                    repeat=5))
+        results[name] = seconds / NUMBER * 1e6
+        print(f"{name:>12}: {results[name]:8.1f} µs per table")
+
+    speedup = results["tabulate"] / results["render_table"]
+    print(f"{'speedup':>12}: {speedup:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
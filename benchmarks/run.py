@@ -0,0 +1,398 @@
+"""Benchmark suite for the comment-answer and ingestion hot paths.
+
+Seeds a mongomock database with a synthetic full season (700 players with
+38 fixtures each and 380 results), then measures the latency of answering
+player vs. player and player vs. team comments, the throughput of the
+ingestion stages and the import time of each entry point. The results are
+stored as JSON so they can be compared across commits:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --compare benchmarks/results/<commit>.json
+
+Note that mongomock doesn't use indexes, so every query scans the whole
+collection. The latencies of replies, which query the per-fixture
+collections, are therefore much higher than with MongoDB itself.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+import mongomock
+
+dirname = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(dirname, "..", "FPLbot"))
+
+import bot  # noqa: E402
+import repository  # noqa: E402
+import utils  # noqa: E402
+from name_index import PlayerNameIndex  # noqa: E402
+
+TEAMS = [
+    "Arsenal", "Aston Villa", "Brentford", "Brighton", "Burnley", "Chelsea",
+    "Crystal Palace", "Everton", "Leeds", "Leicester", "Liverpool",
+    "Man City", "Man Utd", "Newcastle", "Norwich", "Southampton", "Spurs",
+    "Watford", "Wolves", "Fulham"
+]
+NUMBER_OF_PLAYERS = 700
+SYLLABLES = ["ba", "del", "ko", "ran", "si", "mu", "te", "lo", "vic", "an",
+             "ez", "ri", "son", "ma", "gu", "lin", "do", "fer", "ne", "ho"]
+REPLY_SAMPLES = 300
+INGEST_REPEATS = 5
+STARTUP_MODULES = ["cli", "init", "bot", "pricechange_time", "starting_eleven"]
+STARTUP_REPEATS = 5
+
+
+def create_name():
+    return "".join(random.choice(SYLLABLES)
+                   for _ in range(random.randint(2, 4))).title()
+
+
+def create_fixtures():
+    """Returns a double round-robin schedule of 380 fixtures."""
+    fixtures = []
+    start = datetime(2021, 8, 13)
+    for home_team in TEAMS:
+        for away_team in TEAMS:
+            if home_team == away_team:
+                continue
+            fixtures.append({
+                "id": str(16000 + len(fixtures)),
+                "h_team": home_team,
+                "a_team": away_team,
+                "h_goals": random.randint(0, 4),
+                "a_goals": random.randint(0, 4),
+                "h_xG": random.random() * 3,
+                "a_xG": random.random() * 3
+            })
+
+    random.shuffle(fixtures)
+    for number, fixture in enumerate(fixtures):
+        date = start + timedelta(days=number // 10 * 7)
+        fixture["date"] = f"{date:%Y-%m-%d}"
+    return fixtures
+
+
+def create_results(fixtures):
+    return [{
+        "id": fixture["id"],
+        "h": {"title": fixture["h_team"]},
+        "a": {"title": fixture["a_team"]},
+        "goals": {"h": str(fixture["h_goals"]),
+                  "a": str(fixture["a_goals"])},
+        "xG": {"h": str(fixture["h_xG"]), "a": str(fixture["a_xG"])},
+        "datetime": f"{fixture['date']} 15:00:00"
+    } for fixture in fixtures]
+
+
+def create_player(player_id, fixtures):
+    """Returns a player with their FPL history and Understat match history, as
+    retrieved by update_players.
+    """
+    team = TEAMS[player_id % len(TEAMS)]
+    team_fixtures = [fixture for fixture in fixtures
+                     if team in (fixture["h_team"], fixture["a_team"])]
+    team_fixtures.sort(key=lambda fixture: fixture["date"])
+
+    history = []
+    understat_history = []
+    for fixture in team_fixtures:
+        minutes = random.choice([0, 15, 60, 90, 90, 90])
+        goals = random.choice([0, 0, 0, 1, 2]) if minutes else 0
+        assists = random.choice([0, 0, 0, 1]) if minutes else 0
+        history.append({
+            "fixture": int(fixture["id"]),
+            "kickoff_time": f"{fixture['date']}T15:00:00Z",
+            "was_home": fixture["h_team"] == team,
+            "minutes": minutes,
+            "total_points": random.randint(0, 15) if minutes else 0,
+            "bonus": random.randint(0, 3) if minutes else 0,
+            "goals_scored": goals,
+            "assists": assists,
+            "goals_conceded": random.randint(0, 3) if minutes else 0,
+            "saves": random.randint(0, 6) if minutes else 0
+        })
+        if not minutes:
+            continue
+
+        xG = random.random() if minutes else 0
+        understat_history.append({
+            "id": fixture["id"],
+            "h_team": fixture["h_team"],
+            "a_team": fixture["a_team"],
+            "h_goals": str(fixture["h_goals"]),
+            "a_goals": str(fixture["a_goals"]),
+            "date": fixture["date"],
+            "season": "2021",
+            "position": random.choice(["FW", "AMC", "Sub"]),
+            "time": str(minutes),
+            "goals": str(goals),
+            "assists": str(assists),
+            "npg": str(goals),
+            "key_passes": str(random.randint(0, 4)),
+            "shots": str(random.randint(0, 5)),
+            "xG": str(xG),
+            "xA": str(random.random()),
+            "npxG": str(xG)
+        })
+
+    # Understat lists the most recent fixture first
+    understat_history.reverse()
+    first_name = create_name()
+    second_name = create_name()
+    return {
+        "id": player_id,
+        "web_name": second_name,
+        "first_name": first_name,
+        "second_name": second_name,
+        "team": team,
+        "element_type": player_id % 4 + 1,
+        "now_cost": random.randint(40, 130),
+        "selected_by_percent": f"{random.random() * 50:.1f}",
+        "event_points": history[-1]["total_points"],
+        "minutes": sum(fixture["minutes"] for fixture in history),
+        "history": history,
+        "understat_history": understat_history,
+        "games": str(len(understat_history)),
+        "time": str(sum(int(match["time"]) for match in understat_history)),
+        "xG": str(sum(float(match["xG"]) for match in understat_history))
+    }
+
+
+def create_understat_players(players):
+    """Returns the Understat league players matching the given players."""
+    return [{
+        "id": str(player["id"]),
+        "player_name": f"{player['first_name']} {player['second_name']}",
+        "team_title": player["team"],
+        "games": player["games"],
+        "time": player["time"],
+        "xG": player["xG"]
+    } for player in players]
+
+
+def seed_database(database):
+    fixtures = create_fixtures()
+    players = [create_player(player_id, fixtures)
+               for player_id in range(1, NUMBER_OF_PLAYERS + 1)]
+    database.players.insert_many([
+        {key: value for key, value in player.items()
+         if key not in ("history", "understat_history")}
+        for player in players
+    ])
+    database.fpl_history.insert_many([
+        {**fixture, "player_id": player["id"]}
+        for player in players for fixture in player["history"]
+    ])
+    database.understat_matches.insert_many([
+        utils.create_understat_match(player["id"], match)
+        for player in players for match in player["understat_history"]
+    ])
+    database.results.insert_many(create_results(fixtures))
+    database.player_aggregates.insert_many(utils.create_aggregates())
+    repository.create_indexes()
+    return players
+
+
+def percentile(timings, percent):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * percent))]
+
+
+def measure_latency(function, arguments):
+    """Returns the p50/p95 latency (in milliseconds) of calling the function
+    with each of the given arguments.
+    """
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(*argument)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {"p50_ms": round(percentile(timings, 0.5), 4),
+            "p95_ms": round(percentile(timings, 0.95), 4),
+            "samples": len(timings)}
+
+
+def measure_throughput(function, number_of_items):
+    """Returns the number of items per second the function processes."""
+    timings = []
+    for _ in range(INGEST_REPEATS):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {"items_per_second": round(number_of_items / min(timings), 1),
+            "items": number_of_items}
+
+
+def measure_startup(module):
+    """Returns the time (in milliseconds) it takes to import the module in a
+    fresh interpreter, as reported by `python -X importtime`.
+    """
+    timings = []
+    for _ in range(STARTUP_REPEATS):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=os.path.join(dirname, "..", "FPLbot"), stderr=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, check=True).stderr.decode()
+        # The last line is the module itself, with its cumulative time in µs
+        cumulative = output.strip().splitlines()[-1].split("|")[1]
+        timings.append(int(cumulative) / 1000)
+
+    return {"import_ms": round(min(timings), 1)}
+
+
+def measure_document_size(find, player_ids):
+    """Returns the average size (in bytes) of the BSON encoded players
+    returned by the query.
+    """
+    sizes = [len(bson.encode(find(player_id))) for player_id in player_ids]
+    return round(sum(sizes) / len(sizes))
+
+
+def create_bot(database, reply_cache_size):
+    """Returns an FPLBot which uses the given database, without connecting
+    to Reddit.
+    """
+    fpl_bot = bot.FPLBot.__new__(bot.FPLBot)
+    fpl_bot.config = {}
+    fpl_bot.database = database
+    fpl_bot.reply_cache = utils.ReplyCache(maxsize=reply_cache_size)
+    return fpl_bot
+
+
+def run_benchmarks():
+    random.seed(0)
+    # Every module uses the shared client of the repository
+    repository._client = mongomock.MongoClient()
+    database = repository.get_database("fpl")
+    players = seed_database(database)
+
+    # Warm the in-memory indexes, like the bot does at startup
+    utils.get_player_index()
+    utils.get_results_index()
+
+    names = [player["web_name"] for player in players]
+    number_pairs = [(random.choice(names), random.choice(names), 10)
+                    for _ in range(REPLY_SAMPLES)]
+    team_pairs = [(random.choice(names), random.choice(TEAMS).lower(), 10)
+                  for _ in range(REPLY_SAMPLES)]
+    sample_players = [(random.choice(players),)
+                      for _ in range(REPLY_SAMPLES)]
+
+    cold_bot = create_bot(database, reply_cache_size=0)
+    warm_bot = create_bot(database, reply_cache_size=1024)
+    for arguments in number_pairs:
+        warm_bot.versus_player_handler(*arguments)
+
+    results = {}
+    results["find_player"] = measure_latency(
+        utils.find_player, [(pair[0],) for pair in number_pairs])
+    results["get_relevant_matches"] = measure_latency(
+        utils.get_relevant_matches, sample_players)
+    results["player_vs_player_table"] = measure_latency(
+        lambda player: utils.player_vs_player_table([player, player], 10),
+        sample_players)
+    results["versus_player_reply"] = measure_latency(
+        cold_bot.versus_player_handler, number_pairs)
+    results["versus_team_reply"] = measure_latency(
+        cold_bot.versus_team_handler, team_pairs)
+    results["versus_player_reply_cached"] = measure_latency(
+        warm_bot.versus_player_handler, number_pairs)
+
+    player_ids = [player["id"] for player in players]
+    results["player_document"] = {
+        "full_bytes": measure_document_size(
+            lambda player_id: database.players.find_one(
+                {"id": player_id}, {"_id": 0}), player_ids),
+        "table_bytes": measure_document_size(
+            repository.get_table_player, player_ids)
+    }
+
+    understat_players = create_understat_players(players)
+    fpl_players = list(database.players.find({}, {
+        "_id": 0, "id": 1, "web_name": 1, "first_name": 1, "second_name": 1,
+        "team": 1, "selected_by_percent": 1, "games": 1, "time": 1, "xG": 1
+    }))
+    histories = [player["understat_history"] for player in players]
+
+    results["ingest_name_index"] = measure_throughput(
+        lambda: PlayerNameIndex(fpl_players), len(fpl_players))
+    results["ingest_match_understat_players"] = measure_throughput(
+        lambda: utils.match_understat_players(understat_players, fpl_players),
+        len(understat_players))
+    results["ingest_aggregates"] = measure_throughput(
+        utils.create_aggregates, len(players))
+    results["ingest_understat_columns"] = measure_throughput(
+        lambda: [utils.create_understat_columns(history)
+                 for history in histories],
+        len(histories))
+
+    for module in STARTUP_MODULES:
+        results[f"startup_{module}"] = measure_startup(module)
+
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=dirname,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, previous_results):
+    """Prints the change of each benchmark compared to a previous run."""
+    for name, result in results.items():
+        previous = previous_results.get(name)
+        if not previous:
+            continue
+
+        for metric, value in result.items():
+            if metric in ("samples", "items") or not previous.get(metric):
+                continue
+            change = (value - previous[metric]) / previous[metric] * 100
+            print(f"{name:>32} {metric:>16}: {previous[metric]:>12} -> "
+                  f"{value:>12} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="file to store the results in")
+    parser.add_argument("--compare", help="results of a previous run")
+    args = parser.parse_args()
+
+    commit = get_commit()
+    results = run_benchmarks()
+    report = {
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "results": results
+    }
+
+    for name, result in results.items():
+        print(f"{name:>32}: {result}")
+
+    output = args.output or os.path.join(dirname, "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results stored in {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from starting_eleven import find_lineup
+
+TEAM_NEWS_TIME = datetime(2020, 10, 17, 10, 30, tzinfo=timezone.utc)
+
+
+def status(created_at, text, media_url=None):
+    entities = {}
+    if media_url:
+        entities["media"] = [{"media_url_https": media_url}]
+    return SimpleNamespace(created_at=created_at, full_text=text,
+                           entities=entities)
+
+
+def test_find_lineup_ignores_lineups_from_before_team_news():
+    statuses = [
+        status(TEAM_NEWS_TIME + timedelta(minutes=5), "Come on you Spurs!"),
+        status(TEAM_NEWS_TIME - timedelta(days=7), "TEAM NEWS",
+               "https://example.com/old.jpg"),
+    ]
+    assert find_lineup(statuses, TEAM_NEWS_TIME) is None
+
+
+def test_find_lineup_returns_newest_lineup():
+    statuses = [
+        status(TEAM_NEWS_TIME + timedelta(minutes=1), "TEAM NEWS",
+               "https://example.com/new.jpg"),
+        status(TEAM_NEWS_TIME - timedelta(days=7), "TEAM NEWS",
+               "https://example.com/old.jpg"),
+    ]
+    assert find_lineup(statuses, TEAM_NEWS_TIME) == \
+        "https://example.com/new.jpg"
+
+
+def test_find_lineup_accepts_naive_timestamps():
+    statuses = [status(datetime(2020, 10, 17, 10, 29), "TEAM NEWS",
+                       "https://example.com/new.jpg")]
+    assert find_lineup(statuses, TEAM_NEWS_TIME) == \
+        "https://example.com/new.jpg"
@@ -0,0 +1,37 @@
+from utils import match_understat_players
+
+
+def fpl_player(player_id, first_name, second_name, web_name, team):
+    return {"id": player_id, "first_name": first_name,
+            "second_name": second_name, "web_name": web_name, "team": team,
+            "selected_by_percent": "1.0"}
+
+
+def understat_player(player_name, team_title):
+    return {"player_name": player_name, "team_title": team_title}
+
+
+def test_match_understat_players_prefers_exact_match():
+    fpl_players = [fpl_player(1, "Ben", "Davies", "Davies", "Spurs")]
+    understat_players = [understat_player("Ben Davis", "Tottenham"),
+                         understat_player("Ben Davies", "Tottenham")]
+
+    matched, unmatched = match_understat_players(understat_players,
+                                                 fpl_players)
+
+    assert [(player["id"], match["player_name"])
+            for player, match in matched] == [(1, "Ben Davies")]
+    assert [player["player_name"] for player in unmatched] == ["Ben Davis"]
+
+
+def test_match_understat_players_keeps_best_fuzzy_match():
+    fpl_players = [fpl_player(1, "Heung-Min", "Son", "Son", "Spurs")]
+    understat_players = [understat_player("Son Ho-Jun", "Tottenham"),
+                         understat_player("Son Heung-Min", "Tottenham")]
+
+    matched, unmatched = match_understat_players(understat_players,
+                                                 fpl_players)
+
+    assert [(player["id"], match["player_name"])
+            for player, match in matched] == [(1, "Son Heung-Min")]
+    assert [player["player_name"] for player in unmatched] == ["Son Ho-Jun"]